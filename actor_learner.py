@@ -0,0 +1,202 @@
+""" Multiprocess actor/learner training: CPU actors play headless games and stream transitions to a single learner """
+import multiprocessing as mp
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from inference import NumpyQNetwork
+from metrics import TrainingMetrics
+from tetris_env import TetrisEnv
+from training_loop import TRAINING_DEFAULTS, learn
+
+
+PACKED_STATE_SIZE = 25  # 200 binary cells packed 8 per byte
+
+
+# Single-producer ring of packed transitions in shared memory, written by one actor and drained by the learner
+class TransitionChannel:
+    def __init__(self, context, capacity: int = 20000):
+        self.capacity = capacity
+        self.states = context.RawArray('B', capacity * PACKED_STATE_SIZE)
+        self.states_prime = context.RawArray('B', capacity * PACKED_STATE_SIZE)
+        self.actions = context.RawArray('q', capacity)
+        self.rows_cleared = context.RawArray('q', capacity)
+        self.terminals = context.RawArray('B', capacity)
+        # `reserved` is raised before a write touches the ring and `written` after it, so a reader can tell which copied rows may be torn
+        self.reserved = context.Value('q', 0)
+        self.written = context.Value('q', 0)
+
+    def views(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return (np.frombuffer(self.states, dtype=np.uint8).reshape(self.capacity, PACKED_STATE_SIZE),
+                np.frombuffer(self.actions, dtype=np.int64),
+                np.frombuffer(self.rows_cleared, dtype=np.int64),
+                np.frombuffer(self.states_prime, dtype=np.uint8).reshape(self.capacity, PACKED_STATE_SIZE),
+                np.frombuffer(self.terminals, dtype=np.uint8))
+
+    def write(self, states: np.ndarray, actions: np.ndarray, rows_cleared: np.ndarray, states_prime: np.ndarray, terminals: np.ndarray):
+        start = self.written.value
+        with self.reserved.get_lock():
+            self.reserved.value = start + len(actions)
+        indices = (start + np.arange(len(actions))) % self.capacity
+        for view, values in zip(self.views(), (states, actions, rows_cleared, states_prime, terminals)):
+            view[indices] = values
+
+        # Publish only after the entries are in place so the learner never reads half-written rows
+        with self.written.get_lock():
+            self.written.value = start + len(actions)
+
+    def read(self, read_count: int) -> tuple[int, Optional[tuple]]:
+        # New read count and the rows that arrived since, which may be fewer than the difference when the learner fell behind
+        written = self.written.value
+        if written == read_count:
+            return read_count, None
+
+        # If the learner fell more than a ring behind, the oldest unread transitions were overwritten and are skipped
+        start = max(read_count, written - self.capacity)
+        indices = np.arange(start, written) % self.capacity
+        batch = tuple(view[indices].copy() for view in self.views())
+
+        # The actor keeps writing while rows are copied, any row whose slot it may have reached since is dropped as possibly torn
+        torn = max(0, self.reserved.value - self.capacity - start)
+        if torn >= len(indices):
+            return written, None
+        return written, tuple(values[torn:] for values in batch)
+
+
+# Flat float32 copy of the network weights published by the learner and polled by the actors
+class SharedWeights:
+    def __init__(self, context, shapes: list[tuple]):
+        self.shapes = shapes
+        self.sizes = [int(np.prod(shape)) for shape in shapes]
+        self.buffer = context.RawArray('f', sum(self.sizes))
+        self.version = context.Value('q', 0)
+
+    def publish(self, weights: list[np.ndarray]):
+        flat = np.frombuffer(self.buffer, dtype=np.float32)
+        with self.version.get_lock():
+            flat[:] = np.concatenate([np.asarray(w, dtype=np.float32).ravel() for w in weights])
+            self.version.value += 1
+
+    def fetch(self) -> tuple[int, list[np.ndarray]]:
+        flat = np.frombuffer(self.buffer, dtype=np.float32)
+        with self.version.get_lock():
+            version = self.version.value
+            flat = flat.copy()
+
+        weights, offset = [], 0
+        for shape, size in zip(self.shapes, self.sizes):
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return version, weights
+
+
+def run_actor(channel: TransitionChannel, shared_weights: SharedWeights, activations: list[str], epsilon: float,
+              sync_interval: int, flush_size: int, stop_event, seed: int, env_seed: Optional[int] = None, generator: str = 'uniform'):
+    # Actors never import TensorFlow, they act with a NumPy copy of the learner's network
+    np.random.seed(seed)
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+    env = TetrisEnv(seed=env_seed, generator=generator)
+    version, weights = shared_weights.fetch()
+    network = NumpyQNetwork(weights=weights, activations=activations)
+
+    buffers = ([], [], [], [], [])
+    state_space = env.reset()
+    steps = 0
+    while not stop_event.is_set():
+        if np.random.uniform(0, 1) < epsilon:
+            action = np.random.choice([0, 1, 2, 3])
+        else:
+            action = int(np.argmax(network(state_space)))
+
+        state_space_prime, _, done, info = env.step(action)
+        for buffer, value in zip(buffers, (np.packbits(state_space.astype(np.uint8)), action, info['rows_cleared'],
+                                           np.packbits(state_space_prime.astype(np.uint8)), done)):
+            buffer.append(value)
+        state_space = env.reset() if done else state_space_prime
+
+        if len(buffers[1]) >= flush_size:
+            channel.write(*(np.array(buffer) for buffer in buffers))
+            buffers = ([], [], [], [], [])
+
+        steps += 1
+        if steps % sync_interval == 0 and shared_weights.version.value != version:
+            version, weights = shared_weights.fetch()
+            network = NumpyQNetwork(weights=weights, activations=activations)
+
+
+def run_actor_learner(num_actors: Optional[int] = None, total_transitions: int = 200000, options: Optional[dict] = None,
+                      publish_every: int = 5000, epsilon: Optional[float] = None, sync_interval: int = 500, flush_size: int = 256,
+                      player=None, generator: str = 'uniform', metrics: Optional[TrainingMetrics] = None):
+    # Spawned (not forked) workers so the actors do not inherit the learner's TensorFlow runtime, which also means
+    # the caller's main module must not import TensorFlow at top level, spawned children re-import it
+    context = mp.get_context('spawn')
+    num_actors = num_actors or max(1, (os.cpu_count() or 2) - 1)
+    # Loop options of training_loop (train_every, mini_batch_size, learning_starts, seed): the learner takes the same train_step per
+    # transition as the episode loop, without per-step learning it fits on a large minibatch every publish_every transitions instead of
+    # once per episode. Weights go out to the actors every publish_every transitions either way
+    options = dict(TRAINING_DEFAULTS, **(options or {}))
+    seed = options['seed']
+    # learn() paces itself on the step counter, a quiet one stands in when the caller keeps no metrics
+    metrics = metrics if metrics is not None else TrainingMetrics(log_every=2 ** 62, verbose=False)
+
+    if player is None:
+        from agent import TetrisAgent
+        player = TetrisAgent()
+    # Actors play micro-moves and ship packed 200-cell boards, other modes would silently train on the wrong inputs
+    hyperparameters = player.hyperparameters()
+    assert(hyperparameters['action_mode'] == 'move' and hyperparameters['state_mode'] == 'board'), "actors only support action_mode='move' and state_mode='board'"
+    epsilon = hyperparameters['epsilon'] if epsilon is None else epsilon
+    shared_weights = SharedWeights(context, shapes=[w.shape for w in player.get_weights()])
+    shared_weights.publish(player.get_weights())
+
+    channels = [TransitionChannel(context) for _ in range(num_actors)]
+    stop_event = context.Event()
+    # Each actor deals its own seeded stream of games when a seed is given
+    actors = [context.Process(target=run_actor, args=(channel, shared_weights, player.dense_activations(), epsilon, sync_interval, flush_size,
+                                                      stop_event, 1000 + i, None if seed is None else seed + i, generator), daemon=True)
+              for i, channel in enumerate(channels)]
+    for actor in actors:
+        actor.start()
+
+    read_counts = [0] * num_actors
+    transitions = 0
+    dropped = 0
+    last_publish = 0
+    start = time.perf_counter()
+    try:
+        while transitions < total_transitions:
+            received = 0
+            for i, channel in enumerate(channels):
+                read_count = read_counts[i]
+                read_counts[i], batch = channel.read(read_count)
+                # Rows overwritten before the learner got to them, or dropped as possibly torn
+                dropped += read_counts[i] - read_count - (0 if batch is None else len(batch[1]))
+                if batch is None:
+                    continue
+                states, actions, rows_cleared, states_prime, terminals = batch
+                rewards = player.batch_reward_function(rows_cleared=rows_cleared, terminal=terminals.astype(bool))
+                with metrics.phase('replay_insert'):
+                    player.update_replay_buffer_batch(states, actions, rewards, states_prime, terminals.astype(bool), packed=True)
+                received += len(actions)
+            if received == 0:
+                time.sleep(0.01)
+                continue
+            transitions += received
+            metrics.step(steps=received, transitions=received, dropped_transitions=dropped)
+            learn(player, metrics, options, steps=received)
+
+            if transitions - last_publish >= publish_every:
+                last_publish = transitions
+                if options['train_every'] <= 0:
+                    with metrics.phase('train_step'):
+                        player.train(mini_batch_size=1000, epochs=1)
+                shared_weights.publish(player.get_weights())
+                print('{} transitions from {} actors, {:.0f} transitions/sec, {} dropped'.format(transitions, num_actors, transitions / (time.perf_counter() - start), dropped))
+    finally:
+        stop_event.set()
+        for actor in actors:
+            actor.join(timeout=5)
+    return player
@@ -1,42 +1,81 @@
 """ File containing functionality for Deep Q-Learning agent to learn and play Tetris """
 import os
+import time
 
 import tensorflow as tf
 import numpy as np
 
+from inference import NumpyQNetwork, export_weights
+from replay_memory import DiskReplayMemory, PrioritizedReplayMemory, ReplayMemory
+from state_encoder import STATE_SIZES
+
 
 class TetrisAgent:
-    def __init__(self):
-        self.__alpha = 2.5e-3           # Define Learning Rate
-        self.__epsilon = float(1/25)    # Define Exploration Rate
-        self.__gamma = 0.80             # Define Discount Factor
+    def __init__(self, action_mode: str = 'move', state_mode: str = 'board', target_update: int = 0, polyak_tau: float = 0.0, double_dqn: bool = False,
+                 alpha: float = 2.5e-3, epsilon: float = float(1/25), gamma: float = 0.80, passive_reward: float = -1, line_reward: float = 100,
+                 tetris_reward: float = 800, game_over_reward: float = -100000, memory: int = 10000):
+        # 'move' picks one of four micro-moves per frame, 'placement' scores every final drop of the piece at once
+        assert(action_mode in ('move', 'placement'))
+        self.__action_mode = action_mode
+
+        # 'board' feeds the 200 occupancy cells, 'features' the compact engineered features from StateEncoder
+        self.__state_mode = state_mode
+        self.__state_size = STATE_SIZES[state_mode]
 
-        self.__passive_reward = -1 # -1
-        self.__line_reward = 100
-        self.__tetris_reward = 800
-        self.__game_over_reward = -100000
+        self.__alpha = alpha            # Define Learning Rate
+        self.__epsilon = epsilon        # Define Exploration Rate
+        self.__gamma = gamma            # Define Discount Factor
 
-        input_layer = tf.keras.layers.Input(shape=(200,))
+        self.__passive_reward = passive_reward
+        self.__line_reward = line_reward
+        self.__tetris_reward = tetris_reward
+        self.__game_over_reward = game_over_reward
+
+        input_layer = tf.keras.layers.Input(shape=(self.__state_size,))
         hidden_layer1 = tf.keras.layers.Dense(128, activation='relu')(input_layer)
         hidden_layer2 = tf.keras.layers.Dense(64, activation='relu')(hidden_layer1)
         hidden_layer3 = tf.keras.layers.Dense(32, activation='relu')(hidden_layer2)
-        output = tf.keras.layers.Dense(4, activation='softmax')(hidden_layer3)
+        # Placement mode regresses one unbounded afterstate value towards rewards, a softmax would squash it into (0, 1)
+        if action_mode == 'placement':
+            output = tf.keras.layers.Dense(1, activation='linear')(hidden_layer3)
+        else:
+            output = tf.keras.layers.Dense(4, activation='softmax')(hidden_layer3)
         self.__agent = tf.keras.Model(inputs=input_layer, outputs=output)
 
         self.__agent.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=self.__alpha),
                              loss=tf.keras.losses.MeanSquaredError(),
                              metrics=['accuracy'])
+
+        # Acting uses a traced tf.function (or a NumPy copy of the weights) instead of Model.predict, which builds a data pipeline per call
+        # The model is closed over as a local, AutoGraph cannot convert name-mangled attributes and there is no control flow to convert anyway
+        model = self.__agent
+        self.__q_function = tf.function(lambda x: model(x, training=False), input_signature=[tf.TensorSpec(shape=(None, self.__state_size), dtype=tf.float32)], autograph=False)
+        self.__inference_mode = 'function'
+        self.__numpy_agent = None
+
+        # Optional frozen copy of the network used for bootstrapping, hard-synced every `target_update` train steps or Polyak-averaged by `polyak_tau`
+        self.__target_update = target_update
+        self.__polyak_tau = polyak_tau
+        self.__double_dqn = double_dqn
+        self.__train_steps = 0
+        self.__target_agent = None
+        if target_update > 0 or polyak_tau > 0:
+            self.__target_agent = tf.keras.models.clone_model(self.__agent)
+            self.__target_agent.set_weights(self.__agent.get_weights())
         
-        self.__experience = 0
-        self.__memory = 10000
-        self.__state_space_replay_buffer = np.array([]).reshape(0, 200)
-        self.__action_space_replay_buffer = np.array([]).reshape(0, 1)
-        self.__reward_replay_buffer = np.array([]).reshape(0, 1)
-        self.__prime_state_space_replay_buffer = np.array([]).reshape(0, 200)
-        self.__terminal_state_replay_buffer = np.array([]).reshape(0, 1)
+        self.__memory = memory
+        self.__replay_memory = ReplayMemory(capacity=self.__memory, state_size=self.__state_size, packed=state_mode == 'board')
+
+    def hyperparameters(self) -> dict:
+        # The constructor arguments this agent was built with, e.g. for logging a sweep trial
+        return {'action_mode': self.__action_mode, 'state_mode': self.__state_mode, 'target_update': self.__target_update, 'polyak_tau': self.__polyak_tau,
+                'double_dqn': self.__double_dqn, 'alpha': self.__alpha, 'epsilon': self.__epsilon, 'gamma': self.__gamma,
+                'passive_reward': self.__passive_reward, 'line_reward': self.__line_reward, 'tetris_reward': self.__tetris_reward,
+                'game_over_reward': self.__game_over_reward, 'memory': self.__memory}
 
     def summary(self):
         self.__agent.summary()
+        print('Replay memory: {}/{} transitions, {:.2f} MB'.format(len(self.__replay_memory), self.__replay_memory.capacity, self.__replay_memory.nbytes() / 1e6))
     
     def reward_function(self, rows_cleared: int = 0, terminal: bool = False) -> int:
         return ((self.__passive_reward * 1 if rows_cleared == 0 else 0) + ((rows_cleared * self.__line_reward) if rows_cleared < 4 else self.__tetris_reward)) if not terminal else self.__game_over_reward
@@ -48,6 +87,24 @@ class TetrisAgent:
             action = np.argmax(self.state_action_q_values(state_space=state_space))
         return action
 
+    def batch_reward_function(self, rows_cleared: np.ndarray, terminal: np.ndarray) -> np.ndarray:
+        # Vectorized reward_function for batches of boards stepped in lockstep
+        rewards = np.where(rows_cleared == 0, self.__passive_reward, np.where(rows_cleared < 4, rows_cleared * self.__line_reward, self.__tetris_reward))
+        return np.where(terminal, self.__game_over_reward, rewards)
+
+    def batch_epsilon_greedy_selection(self, state_spaces: np.ndarray) -> np.ndarray:
+        # Score every state with one forward pass, then explore independently per board
+        actions = np.argmax(self.state_action_q_values(state_space=state_spaces), axis=1)
+        explore = np.random.uniform(0, 1, size=len(actions)) < self.__epsilon
+        actions[explore] = np.random.choice([0, 1, 2, 3], size=int(explore.sum()))
+        return actions
+
+    def select_placement(self, afterstates: np.ndarray) -> int:
+        # Score every candidate afterstate in one batch and return the index of the chosen placement
+        if np.random.uniform(0, 1) < self.__epsilon:
+            return np.random.randint(len(afterstates))
+        return int(np.argmax(self.state_action_q_values(state_space=afterstates)[:, 0]))
+
     def process_state_space(self, piece_position: list[tuple], grid: list[list[tuple]]) -> np.ndarray:       
         state_space = np.zeros(shape=(len(grid), len(grid[0])))
     
@@ -60,53 +117,213 @@ class TetrisAgent:
                     state_space[x][y] = 1
         return state_space.flatten()
     
+    def set_inference_mode(self, mode: str = 'function'):
+        assert(mode in ('predict', 'function', 'numpy'))
+        self.__inference_mode = mode
+        self.sync_inference_weights()
+
+    def sync_inference_weights(self):
+        # The NumPy path holds a copy of the weights and must be refreshed whenever the network changes
+        if self.__inference_mode == 'numpy':
+            self.__numpy_agent = NumpyQNetwork(weights=self.__agent.get_weights(), activations=self.dense_activations())
+
     def state_action_q_values(self, state_space: np.ndarray) -> np.ndarray:
+        if self.__inference_mode == 'numpy':
+            return self.__numpy_agent(state_space)
+        if self.__inference_mode == 'function':
+            return self.__q_function(tf.convert_to_tensor(np.asarray(state_space, dtype=np.float32).reshape(-1, self.__state_size))).numpy()
         return self.__agent.predict(x=state_space)
     
     def update_replay_buffer(self, state_space: np.ndarray, action: int, reward: int, state_space_prime: np.ndarray, terminal_state: bool):
-        if self.__experience <= self.__memory:
-            self.__state_space_replay_buffer = np.vstack((self.__state_space_replay_buffer, state_space))
-            self.__action_space_replay_buffer = np.vstack((self.__action_space_replay_buffer, action))
-            self.__reward_replay_buffer = np.vstack((self.__reward_replay_buffer, reward))
-            self.__prime_state_space_replay_buffer = np.vstack((self.__prime_state_space_replay_buffer, state_space_prime))
-            self.__terminal_state_replay_buffer = np.vstack((self.__terminal_state_replay_buffer, terminal_state))
-        else: 
-            self.__state_space_replay_buffer[self.__experience % self.__memory] = state_space
-            self.__action_space_replay_buffer[self.__experience % self.__memory] = action
-            self.__reward_replay_buffer[self.__experience % self.__memory] = reward
-            self.__prime_state_space_replay_buffer[self.__experience % self.__memory] = state_space_prime
-            self.__terminal_state_replay_buffer[self.__experience % self.__memory] = terminal_state
-        self.__experience += 1
-
-    def train(self, mini_batch_size: int = 1000, epochs: int = 1):        
-        target_Q_vals_batch = np.array([]).reshape(0, 4)
-
-        batch = np.random.randint(low=0, high=min(mini_batch_size, self.__experience), size=min(mini_batch_size, self.__experience))
-        state_space_batch = self.__state_space_replay_buffer[batch]
-        action_space_batch = self.__action_space_replay_buffer[batch]
-        reward_batch = self.__reward_replay_buffer[batch]
-        state_prime_batch = self.__prime_state_space_replay_buffer[batch]
-        terminal_state_batch = self.__terminal_state_replay_buffer[batch] 
-
-        for state, action, reward, state_prime, terminal in zip(state_space_batch, action_space_batch, reward_batch, state_prime_batch, terminal_state_batch):
-            state_Q_vals = self.state_action_q_values(state_space=state.reshape(1, -1))
-            state_prime_Q_vals = self.state_action_q_values(state_space=state_prime.reshape(1, -1))
-            
-            target_Q_vals = state_Q_vals
-            if terminal:
-                target_Q_vals[0][int(action)] = reward
-            else:
-                target_Q_vals[0][int(action)] = reward + (self.__gamma * np.max(state_prime_Q_vals))
-            target_Q_vals_batch = np.vstack((target_Q_vals_batch, target_Q_vals))
-        
-        self.__agent.fit(x=state_space_batch, y=target_Q_vals_batch, epochs=epochs, verbose=1)
+        self.__replay_memory.add(state_space, action, reward, state_space_prime, terminal_state)
+
+    def update_replay_buffer_batch(self, state_spaces: np.ndarray, actions: np.ndarray, rewards: np.ndarray, state_spaces_prime: np.ndarray, terminal_states: np.ndarray, packed: bool = False):
+        self.__replay_memory.add_batch(state_spaces, actions, rewards, state_spaces_prime, terminal_states, encoded=packed)
+
+    def replay_stats(self) -> dict:
+        size, capacity = len(self.__replay_memory), self.__replay_memory.capacity
+        return {'replay_size': size, 'replay_fill': round(size / capacity, 4), 'replay_mb': round(self.__replay_memory.nbytes() / 1e6, 2)}
+
+    def use_disk_replay_memory(self, directory: str, capacity: int = 1000000):
+        # Swap the in-RAM memory for a memory-mapped one that survives restarts, reopening a directory resumes it
+        assert(self.__state_mode == 'board')
+        self.__replay_memory = DiskReplayMemory(directory, capacity=capacity, state_size=self.__state_size)
+
+    def use_prioritized_replay_memory(self, capacity: int = 1000000, alpha: float = 0.6, beta: float = 0.4):
+        # Swap the in-RAM memory for one sampled in proportion to TD error, train() then weights the fit by importance sampling
+        self.__replay_memory = PrioritizedReplayMemory(capacity=capacity, state_size=self.__state_size, packed=self.__state_mode == 'board', alpha=alpha, beta=beta)
+
+    def save_replay_memory(self, directory: str):
+        stored = DiskReplayMemory(directory, capacity=self.__replay_memory.capacity, state_size=self.__state_size)
+        self.copy_transitions(source=self.__replay_memory, target=stored)
+        stored.flush()
+
+    def warm_start(self, directory: str):
+        # Fill the replay memory with the most recent stored transitions, without replaying the games that produced them
+        self.copy_transitions(source=DiskReplayMemory(directory, state_size=self.__state_size, create=False), target=self.__replay_memory)
+
+    def flush_replay_memory(self):
+        # A disk-backed memory only writes its metadata every few thousand inserts, call this before the process exits
+        self.__replay_memory.flush()
+
+    @staticmethod
+    def copy_transitions(source: ReplayMemory, target: ReplayMemory, chunk_size: int = 100000):
+        assert(source.packed and target.packed)
+        indices = source.latest_indices(target.capacity)
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            target.add_batch(source.states[chunk], source.actions[chunk], source.rewards[chunk], source.states_prime[chunk], source.terminals[chunk], encoded=True)
+
+    def next_state_values(self, state_prime_batch: np.ndarray) -> np.ndarray:
+        # Bootstrap values of the next states, from the target network when there is one
+        evaluator = self.__agent if self.__target_agent is None else self.__target_agent
+        state_prime_Q_vals = np.array(evaluator.predict_on_batch(state_prime_batch))
+
+        # In placement mode the single output is the value of an afterstate rather than of a micro-move
+        if self.__action_mode == 'placement':
+            return state_prime_Q_vals[:, 0]
+        if self.__double_dqn:
+            # The online network selects the next action and the evaluator scores it, which curbs the max-operator overestimation
+            online_Q_vals = state_prime_Q_vals if evaluator is self.__agent else np.array(self.__agent.predict_on_batch(state_prime_batch))
+            return state_prime_Q_vals[np.arange(len(state_prime_Q_vals)), np.argmax(online_Q_vals, axis=1)]
+        return np.max(state_prime_Q_vals, axis=1)
+
+    def sample_batch(self, mini_batch_size: int) -> tuple[np.ndarray, tuple, np.ndarray]:
+        # Sampled indices, the decoded transitions and their importance-sampling weights (None for uniform sampling)
+        indices = self.__replay_memory.sample_indices(mini_batch_size)
+        sample_weights = None
+        if isinstance(self.__replay_memory, PrioritizedReplayMemory):
+            sample_weights = self.__replay_memory.importance_weights(indices)
+        return indices, self.__replay_memory.get(indices), sample_weights
+
+    def apply_targets(self, Q_vals_batch: np.ndarray, indices: np.ndarray, action_space_batch: np.ndarray, targets: np.ndarray):
+        # Overwrite the taken actions' Q-values with their targets, the TD errors become the new priorities when sampling is prioritized
+        rows = np.arange(len(action_space_batch))
+        if isinstance(self.__replay_memory, PrioritizedReplayMemory):
+            self.__replay_memory.update_priorities(indices, targets - Q_vals_batch[rows, action_space_batch])
+        Q_vals_batch[rows, action_space_batch] = targets
+
+    def train(self, mini_batch_size: int = 1000, epochs: int = 1) -> dict:
+        timings = {}
+        start = time.perf_counter()
+
+        indices, (state_space_batch, action_space_batch, reward_batch, state_prime_batch, terminal_state_batch), sample_weights = self.sample_batch(mini_batch_size)
+        timings['sample'] = time.perf_counter() - start
+
+        # One forward pass over every sampled state and one (two for Double-DQN with a target network) over every next state
+        start = time.perf_counter()
+        target_Q_vals_batch = np.array(self.__agent.predict_on_batch(state_space_batch))
+        state_prime_values = self.next_state_values(state_prime_batch)
+        timings['forward'] = time.perf_counter() - start
+
+        # Bellman targets for the taken actions, terminal transitions do not bootstrap
+        start = time.perf_counter()
+        bootstrap = self.__gamma * state_prime_values * (1 - terminal_state_batch)
+        self.apply_targets(target_Q_vals_batch, indices, action_space_batch, reward_batch + bootstrap)
+        timings['targets'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.__agent.fit(x=state_space_batch, y=target_Q_vals_batch, sample_weight=sample_weights, epochs=epochs, verbose=1)
+        self.finish_train_step()
+        timings['fit'] = time.perf_counter() - start
+
+        print('Train step on {} transitions: '.format(len(action_space_batch)) + ', '.join('{} {:.1f} ms'.format(phase, seconds * 1000) for phase, seconds in timings.items()))
+        return timings
+
+    def train_step(self, mini_batch_size: int = 32) -> float:
+        # A single gradient step on a small minibatch, for learning every few environment steps instead of once per episode
+        indices, (state_space_batch, action_space_batch, reward_batch, state_prime_batch, terminal_state_batch), sample_weights = self.sample_batch(mini_batch_size)
+
+        target_Q_vals_batch = np.array(self.__agent.predict_on_batch(state_space_batch))
+        bootstrap = self.__gamma * self.next_state_values(state_prime_batch) * (1 - terminal_state_batch)
+        self.apply_targets(target_Q_vals_batch, indices, action_space_batch, reward_batch + bootstrap)
+
+        loss = self.__agent.train_on_batch(x=state_space_batch, y=target_Q_vals_batch, sample_weight=sample_weights)
+        self.finish_train_step()
+        return float(np.ravel(loss)[0])
+
+    def finish_train_step(self):
+        self.__train_steps += 1
+        self.update_target_network()
+        self.sync_inference_weights()
+
+    def update_target_network(self):
+        if self.__target_agent is None:
+            return
+        if self.__polyak_tau > 0:
+            # Soft update applied in place on the variables, without a round trip through NumPy
+            for target, online in zip(self.__target_agent.weights, self.__agent.weights):
+                target.assign(self.__polyak_tau * online + (1 - self.__polyak_tau) * target)
+        elif self.__train_steps % self.__target_update == 0:
+            self.sync_target_network()
+
+    def sync_target_network(self):
+        if self.__target_agent is not None:
+            for target, online in zip(self.__target_agent.weights, self.__agent.weights):
+                target.assign(online)
+
+    def train_steps(self) -> int:
+        return self.__train_steps
+
+    def optimizer_variables(self) -> list:
+        # A method on older Keras optimizers, a property on newer ones
+        variables = self.__agent.optimizer.variables
+        return variables() if callable(variables) else variables
+
+    def get_training_state(self) -> dict:
+        # Copies of everything a resumed run needs, taken on the training thread so they can be written out while training continues
+        return {'action_mode': self.__action_mode, 'state_mode': self.__state_mode,
+                'weights': self.__agent.get_weights(),
+                'target_weights': self.__target_agent.get_weights() if self.__target_agent is not None else None,
+                'optimizer': [np.array(variable) for variable in self.optimizer_variables()],
+                'epsilon': self.__epsilon, 'train_steps': self.__train_steps,
+                'replay': self.__replay_memory.state_dict(), 'np_random': np.random.get_state()}
+
+    def set_training_state(self, state: dict):
+        assert(state['action_mode'] == self.__action_mode and state['state_mode'] == self.__state_mode), "snapshot was taken with different modes"
+        self.__agent.set_weights(state['weights'])
+
+        # Adam only creates its moment slots on the first update, a zero-gradient step builds them so they can be overwritten
+        if len(self.optimizer_variables()) != len(state['optimizer']):
+            trainable = self.__agent.trainable_variables
+            self.__agent.optimizer.apply_gradients(zip([tf.zeros_like(variable) for variable in trainable], trainable))
+        for variable, value in zip(self.optimizer_variables(), state['optimizer']):
+            variable.assign(value)
+
+        if state['target_weights'] is not None and self.__target_agent is not None:
+            self.__target_agent.set_weights(state['target_weights'])
+        else:
+            self.sync_target_network()
+
+        self.__epsilon = state['epsilon']
+        self.__train_steps = state['train_steps']
+        self.__replay_memory.load_state_dict(state['replay'])
+        np.random.set_state(state['np_random'])
+        self.sync_inference_weights()
+
+    def get_weights(self) -> list[np.ndarray]:
+        return self.__agent.get_weights()
+
+    def set_weights(self, weights: list[np.ndarray]):
+        self.__agent.set_weights(weights)
+        self.sync_target_network()
+        self.sync_inference_weights()
+
+    def dense_activations(self) -> list[str]:
+        return [layer.activation.__name__ for layer in self.__agent.layers if isinstance(layer, tf.keras.layers.Dense)]
 
     def save_model(self, outdir: str = './dql_tetris.h5'):
         assert(outdir is not None)
+        # A .npz path exports only the weights, for inference.InferenceAgent to play without TensorFlow
+        if outdir.endswith('.npz'):
+            export_weights(outdir, self.__agent.get_weights(), self.dense_activations(), action_mode=self.__action_mode, state_mode=self.__state_mode)
+            return
         self.__agent.save(filepath=outdir)
 
     def load_model(self, model_weights: str = './dql_tetris.h5'):
         assert(os.path.exists(model_weights))
         assert(os.path.isfile(model_weights))
         self.__agent.load_weights(filepath=model_weights)
+        self.sync_target_network()
+        self.sync_inference_weights()
         
\ No newline at end of file
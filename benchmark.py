@@ -0,0 +1,275 @@
+""" CPU-only benchmark suite for the engine, encoder, replay and learner hot paths, with baseline regression checks """
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from bitboard import BitBoard
+from locked_positions import LockedPositions
+from piece import Piece
+from replay_memory import PrioritizedReplayMemory, ReplayMemory
+from state_encoder import StateEncoder
+from tetris import Tetris
+from tetris_env import TetrisEnv
+from vector_env import VectorTetris
+
+SEED = 1234
+
+
+def synthetic_locked_positions(rng: random.Random, rows: int = 20, columns: int = 10, height: int = 8, full_rows: int = 0) -> dict:
+	# Random stack of `height` rows with ~70% filled cells, the lowest `full_rows` rows completely filled
+	locked = {}
+	for y in range(rows - height, rows):
+		for x in range(columns):
+			if y >= rows - full_rows or rng.random() < 0.7:
+				locked[(x, y)] = (255, 0, 0)
+	return locked
+
+
+def synthetic_piece(rng: random.Random, shapes: list[str]) -> Piece:
+	piece = Piece(rng.choice(shapes))
+	piece.x, piece.y, piece.rotation = rng.randrange(0, 10), rng.randrange(0, 20), rng.randrange(4)
+	return piece
+
+
+def measure(function: Callable[[int], None], number: int, repeat: int) -> dict:
+	# `function(i)` runs the i-th operation, each call is timed on its own so the percentiles are per-operation latencies
+	# (including one perf_counter call each), throughput is taken from the total time of all `repeat` batches of `number` calls
+	# The untimed warm-up call gets the index after the timed ones so every index is used exactly once
+	function(number * repeat)
+	latencies = np.zeros(number * repeat)
+	clock = time.perf_counter
+	for r in range(repeat):
+		stamps = [clock()]
+		for i in range(number):
+			function(r * number + i)
+			stamps.append(clock())
+		latencies[r * number:(r + 1) * number] = np.diff(stamps)
+	return {'ops_per_sec': round(len(latencies) / latencies.sum(), 1), 'p50_us': round(np.percentile(latencies, 50) * 1e6, 2),
+			'p95_us': round(np.percentile(latencies, 95) * 1e6, 2), 'p99_us': round(np.percentile(latencies, 99) * 1e6, 2)}
+
+
+def bench_valid_space(number: int, repeat: int) -> dict:
+	rng = random.Random(SEED)
+	tetris = Tetris(seed=SEED)
+	grids = [tetris.create_grid(synthetic_locked_positions(rng)) for _ in range(64)]
+	pieces = [synthetic_piece(rng, tetris.shapes) for _ in range(256)]
+	return measure(lambda i: tetris.valid_space(pieces[i % 256], grids[i % 64]), number, repeat)
+
+
+def bench_bitboard_valid_space(number: int, repeat: int) -> dict:
+	rng = random.Random(SEED)
+	tetris = Tetris(seed=SEED)
+	boards = []
+	for _ in range(64):
+		board = BitBoard()
+		for x, y in synthetic_locked_positions(rng):
+			board.board[y] |= 1 << x
+		boards.append(board)
+	pieces = [synthetic_piece(rng, tetris.shapes) for _ in range(256)]
+	return measure(lambda i: boards[i % 64].valid_space(pieces[i % 256]), number, repeat)
+
+
+def bench_clear_rows(number: int, repeat: int) -> dict:
+	rng = random.Random(SEED)
+	tetris = Tetris(seed=SEED)
+	templates = [synthetic_locked_positions(rng, full_rows=rng.randrange(0, 4)) for _ in range(64)]
+	# Fresh copies are made up front so only clear_rows itself is timed
+	copies = [dict(templates[i % 64]) for i in range(number * (repeat + 1))]
+	grids = [tetris.create_grid(template) for template in templates]
+	return measure(lambda i: tetris.clear_rows(grids[i % 64], copies[i]), number, repeat)
+
+
+def bench_locked_clear_rows(number: int, repeat: int) -> dict:
+	# Same boards as clear_rows, held in the counter-tracking store the windowed game uses
+	rng = random.Random(SEED)
+	tetris = Tetris(seed=SEED)
+	templates = [LockedPositions(positions=synthetic_locked_positions(rng, full_rows=rng.randrange(0, 4))) for _ in range(64)]
+	copies = [templates[i % 64].copy() for i in range(number * (repeat + 1))]
+	grids = [tetris.create_grid(template) for template in templates]
+	return measure(lambda i: tetris.clear_rows(grids[i % 64], copies[i]), number, repeat)
+
+
+def bench_state_encoder(number: int, repeat: int) -> dict:
+	rng = random.Random(SEED)
+	tetris = Tetris(seed=SEED)
+	encoder = StateEncoder()
+	encoder.refresh(synthetic_locked_positions(rng))
+	positions = [tetris.convert_shape_format(synthetic_piece(rng, tetris.shapes)) for _ in range(256)]
+	return measure(lambda i: encoder.encode(positions[i % 256]), number, repeat)
+
+
+def bench_replay_insert(number: int, repeat: int) -> dict:
+	rng = np.random.default_rng(SEED)
+	memory = ReplayMemory(capacity=10000)
+	states = (rng.random(size=(256, 200)) < 0.3).astype(np.float64)
+	return measure(lambda i: memory.add(states[i % 256], i % 4, -1, states[(i + 1) % 256], False), number, repeat)
+
+
+def bench_replay_sample(number: int, repeat: int) -> dict:
+	rng = np.random.default_rng(SEED)
+	memory = ReplayMemory(capacity=10000, seed=SEED)
+	states = (rng.random(size=(10000, 200)) < 0.3).astype(np.float64)
+	memory.add_batch(states, rng.integers(4, size=10000), np.full(10000, -1), states, np.zeros(10000, dtype=bool))
+	return measure(lambda i: memory.sample(1000), number, repeat)
+
+
+def bench_prioritized_sample(number: int, repeat: int) -> dict:
+	# Sampling, importance weights and priority updates of 32-transition batches from a full 1M-entry sum-tree
+	rng = np.random.default_rng(SEED)
+	memory = PrioritizedReplayMemory(capacity=1000000, seed=SEED)
+	for _ in range(10):
+		states = rng.integers(256, size=(100000, 25), dtype=np.uint8)
+		memory.add_batch(states, rng.integers(4, size=100000), np.full(100000, -1), states, np.zeros(100000, dtype=bool), encoded=True)
+	td_errors = rng.normal(size=(64, 32)) * 100
+
+	def sample(i: int):
+		indices = memory.sample_indices(32)
+		memory.importance_weights(indices)
+		memory.update_priorities(indices, td_errors[i % 64])
+	return measure(sample, max(1, number // 10), repeat)
+
+
+def bench_env_step(number: int, repeat: int) -> dict:
+	env = TetrisEnv(seed=SEED)
+	env.reset()
+	actions = np.random.default_rng(SEED).integers(4, size=number * (repeat + 1))
+
+	def step(i: int):
+		if env.step(int(actions[i]))[2]:
+			env.reset()
+	return measure(step, number, repeat)
+
+
+def bench_vector_step(number: int, repeat: int) -> dict:
+	env = VectorTetris(num_envs=256, seed=SEED)
+	env.reset()
+	actions = np.random.default_rng(SEED).integers(4, size=(16, 256))
+	result = measure(lambda i: env.step(actions[i % 16]), number, repeat)
+	result['board_steps_per_sec'] = round(result['ops_per_sec'] * 256, 1)
+	return result
+
+
+def bench_headless_episode(number: int, repeat: int) -> dict:
+	# End-to-end random-policy games, each op is one full episode
+	env = TetrisEnv(seed=SEED)
+	rng = random.Random(SEED)
+
+	def episode(i: int):
+		env.reset(seed=SEED + i)
+		done = False
+		while not done:
+			done = env.step(rng.randrange(4))[2]
+	return measure(episode, max(1, number // 100), repeat)
+
+
+def agent_benchmarks() -> dict:
+	# The learner hot paths need TensorFlow, they are skipped when it is not installed
+	try:
+		from agent import TetrisAgent
+	except ImportError:
+		print('TensorFlow not available, skipping agent benchmarks')
+		return {}
+
+	tf_rng = np.random.default_rng(SEED)
+	np.random.seed(SEED)
+	agent = TetrisAgent()
+	states = (tf_rng.random(size=(256, 200)) < 0.3).astype(np.float64)
+
+	# train() gets its own agent with a full, seeded replay memory, so it never times an empty sample and does not depend on
+	# whether update_replay_buffer ran before it
+	train_agent = TetrisAgent()
+	capacity = train_agent.hyperparameters()['memory']
+	train_agent.update_replay_buffer_batch(states[tf_rng.integers(256, size=capacity)], tf_rng.integers(4, size=capacity),
+										   tf_rng.choice([-1, 100, 800], size=capacity), states[tf_rng.integers(256, size=capacity)],
+										   tf_rng.random(size=capacity) < 0.01)
+
+	tetris = Tetris(seed=SEED)
+	grid = tetris.create_grid(synthetic_locked_positions(random.Random(SEED)))
+	piece_position = tetris.convert_shape_format(Piece('T'))
+
+	def train(number: int, repeat: int) -> dict:
+		return measure(lambda i: train_agent.train(mini_batch_size=1000, epochs=1), max(1, number // 1000), repeat)
+
+	return {
+		'process_state_space': lambda number, repeat: measure(lambda i: agent.process_state_space(piece_position, grid), number, repeat),
+		'update_replay_buffer': lambda number, repeat: measure(lambda i: agent.update_replay_buffer(states[i % 256], i % 4, -1, states[(i + 1) % 256], False), number, repeat),
+		'state_action_q_values': lambda number, repeat: measure(lambda i: agent.state_action_q_values(states[i % 256].reshape(1, -1)), max(1, number // 10), repeat),
+		'train': train,
+	}
+
+
+BENCHMARKS = {
+	'valid_space': bench_valid_space,
+	'bitboard_valid_space': bench_bitboard_valid_space,
+	'clear_rows': bench_clear_rows,
+	'locked_clear_rows': bench_locked_clear_rows,
+	'state_encoder': bench_state_encoder,
+	'replay_insert': bench_replay_insert,
+	'replay_sample': bench_replay_sample,
+	'prioritized_sample': bench_prioritized_sample,
+	'env_step': bench_env_step,
+	'vector_step': bench_vector_step,
+	'headless_episode': bench_headless_episode,
+}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+	# A benchmark regresses when its throughput falls more than `threshold` (a fraction) below the baseline
+	regressions = []
+	for name, result in results.items():
+		if name not in baseline:
+			continue
+		reference = baseline[name]['ops_per_sec']
+		change = (result['ops_per_sec'] - reference) / reference
+		print('{:<24} {:>12.1f} ops/s vs {:>12.1f} baseline ({:+.1%})'.format(name, result['ops_per_sec'], reference, change))
+		if change < -threshold:
+			regressions.append(name)
+	return regressions
+
+
+def run(selected: Optional[list[str]] = None, number: int = 1000, repeat: int = 20, include_agent: bool = True) -> dict:
+	random.seed(SEED)
+	np.random.seed(SEED)
+
+	benchmarks = dict(BENCHMARKS)
+	if include_agent:
+		benchmarks.update(agent_benchmarks())
+
+	results = {}
+	for name, benchmark in benchmarks.items():
+		if selected and name not in selected:
+			continue
+		results[name] = benchmark(number, repeat)
+		print('{:<24} {}'.format(name, ' '.join('{}={}'.format(key, value) for key, value in results[name].items())))
+	return results
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('benchmarks', nargs='*', help='benchmarks to run, all of them by default')
+	parser.add_argument('--number', type=int, default=1000, help='operations per timed batch')
+	parser.add_argument('--repeat', type=int, default=20, help='timed batches per benchmark')
+	parser.add_argument('--baseline', default='./benchmark_baseline.json', help='baseline JSON to compare against')
+	parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+	parser.add_argument('--threshold', type=float, default=0.2, help='allowed fractional drop in ops/sec before failing')
+	parser.add_argument('--no-agent', action='store_true', help='skip the TensorFlow agent benchmarks')
+	args = parser.parse_args()
+
+	results = run(args.benchmarks, number=args.number, repeat=args.repeat, include_agent=not args.no_agent)
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as file:
+			json.dump(results, file, indent=2)
+		print('Saved baseline to {}'.format(args.baseline))
+	elif os.path.exists(args.baseline):
+		with open(args.baseline, 'r') as file:
+			regressions = compare(results, json.load(file), args.threshold)
+		if regressions:
+			print('Regressed beyond {:.0%}: {}'.format(args.threshold, ', '.join(regressions)))
+			sys.exit(1)
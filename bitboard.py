@@ -0,0 +1,137 @@
+""" Compact Tetris board storing one integer bitmask per row, with precomputed per-rotation piece masks """
+from typing import Optional
+
+import numpy as np
+
+from piece import SHAPE_OFFSETS, Piece, bounding_box
+
+
+def compile_piece_masks() -> dict:
+	# For every shape, a list (one per rotation) of (row offset, row mask, lowest column offset, highest column offset) tuples
+	# Row masks set bit dx + 2 for every cell, so shifting by piece.x - 2 places them on the board
+	masks = {}
+	for name, rotations in SHAPE_OFFSETS.items():
+		masks[name] = []
+		for cells in rotations:
+			rotation_rows = []
+			for dy in sorted(set(dy for _, dy in cells)):
+				columns = [dx for dx, cell_dy in cells if cell_dy == dy]
+				mask = 0
+				for dx in columns:
+					mask |= 1 << (dx + 2)
+				rotation_rows.append((dy, mask, min(columns), max(columns)))
+			masks[name].append(tuple(rotation_rows))
+	return masks
+
+
+PIECE_MASKS = compile_piece_masks()
+
+
+class BitBoard:
+	def __init__(self, columns: int = 10, rows: int = 20):
+		self.columns = columns
+		self.rows = rows
+		self.full_row = (1 << columns) - 1
+
+		self.board = [0] * rows
+		self.topped_out = False
+		self.reset()
+
+	def reset(self):
+		self.board = [0] * self.rows
+		self.topped_out = False
+
+	def copy(self) -> 'BitBoard':
+		board = BitBoard(columns=self.columns, rows=self.rows)
+		board.board = list(self.board)
+		board.topped_out = self.topped_out
+		return board
+
+	def drop_height(self, piece: Piece, x: int, y: int, rotation: int) -> int:
+		# Lowest row the piece reaches when dropped straight down from a valid (x, y): the smallest gap below any of its template
+		# rows, each board row tested once per template row instead of re-testing the whole piece at every step down
+		piece_rotations = PIECE_MASKS[piece.name]
+		shift = x - 2
+		# The floor bounds the drop, so the scans below never run past the last row
+		drop = self.rows - 1 - (y + bounding_box(piece.name, rotation)[3])
+		for dy, mask, _, _ in piece_rotations[rotation % len(piece_rotations)]:
+			mask = mask << shift if shift >= 0 else mask >> -shift
+			top = y + dy
+			row = max(top + 1, 0)
+			while row - top <= drop and not self.board[row] & mask:
+				row += 1
+			drop = min(drop, row - top - 1)
+		return y + drop
+
+	def placements(self, piece: Piece, y: Optional[int] = None) -> list[tuple]:
+		# Every legal (rotation, x, y) straight drop of the piece from row y (its current row by default)
+		y = piece.y if y is None else y
+		placements = []
+		for rotation in range(len(piece.shape)):
+			# Only the columns where every cell of the rotation is on the board, rows still above it included
+			min_dx, max_dx, _, _ = bounding_box(piece.name, rotation)
+			for x in range(-min_dx, self.columns - max_dx):
+				if self.valid_space(piece, x=x, y=y, rotation=rotation):
+					placements.append((rotation, x, self.drop_height(piece, x, y, rotation)))
+		return placements
+
+	def afterstate(self, piece: Piece, placement: tuple) -> tuple['BitBoard', int]:
+		# Copy of the board with the piece locked at a placement and full rows cleared, plus the number of rows cleared
+		rotation, x, y = placement
+		board = self.copy()
+		board.lock(piece, x=x, y=y, rotation=rotation)
+		return board, board.clear_rows()
+
+	def placed_rows(self, piece: Piece, x: Optional[int] = None, y: Optional[int] = None, rotation: Optional[int] = None):
+		# Yield (board row, shifted mask, in bounds) for every template row of the piece at the given placement
+		x = piece.x if x is None else x
+		y = piece.y if y is None else y
+		rotation = piece.rotation if rotation is None else rotation
+
+		piece_rotations = PIECE_MASKS[piece.name]
+		shift = x - 2
+		for dy, mask, low, high in piece_rotations[rotation % len(piece_rotations)]:
+			in_bounds = x + low >= 0 and x + high < self.columns
+			yield y + dy, (mask << shift if shift >= 0 else mask >> -shift), in_bounds
+
+	def valid_space(self, piece: Piece, x: Optional[int] = None, y: Optional[int] = None, rotation: Optional[int] = None) -> bool:
+		# Same semantics as Tetris.valid_space, cells above the top of the board are always accepted
+		# Inlined rather than going through placed_rows() since this is the hottest call in every step
+		x = piece.x if x is None else x
+		y = piece.y if y is None else y
+		rotation = piece.rotation if rotation is None else rotation
+
+		piece_rotations = PIECE_MASKS[piece.name]
+		shift = x - 2
+		for dy, mask, low, high in piece_rotations[rotation % len(piece_rotations)]:
+			row = y + dy
+			if row < 0:
+				continue
+			if row >= self.rows or x + low < 0 or x + high >= self.columns:
+				return False
+			if self.board[row] & (mask << shift if shift >= 0 else mask >> -shift):
+				return False
+		return True
+
+	def lock(self, piece: Piece, x: Optional[int] = None, y: Optional[int] = None, rotation: Optional[int] = None):
+		for row, mask, _ in self.placed_rows(piece, x, y, rotation):
+			if row < 0:
+				# A locked cell above the board always ends the game
+				self.topped_out = True
+				continue
+			self.board[row] |= mask
+
+	def clear_rows(self) -> int:
+		remaining = [i for i, row in enumerate(self.board) if row != self.full_row]
+		cleared = self.rows - len(remaining)
+		if cleared:
+			self.board = [0] * cleared + [self.board[i] for i in remaining]
+		return cleared
+
+	def check_loss(self) -> bool:
+		# Equivalent to Tetris.check_loss, any locked cell in the top row (or above it) ends the game
+		return self.topped_out or self.board[0] != 0
+
+	def occupancy(self) -> np.ndarray:
+		bits = np.array(self.board, dtype=np.int64)[:, None] >> np.arange(self.columns)
+		return (bits & 1).astype(np.uint8)
@@ -0,0 +1,111 @@
+""" Compact binary episode logs (seed plus action stream) and a headless re-simulator that regenerates games from them """
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from typing import Callable, Iterator, Optional
+
+from tetris_env import TetrisEnv
+
+
+# magic, format version, piece generator, action mode, seed, number of actions, followed by one byte per action
+HEADER = struct.Struct('<4sBBBxQI')
+MAGIC = b'TTRL'
+VERSION = 1
+
+GENERATOR_IDS = {'uniform': 0, 'bag': 1}
+ACTION_MODE_IDS = {'move': 0, 'placement': 1}
+
+
+class EpisodeLog:
+	def __init__(self, seed: int, generator: str = 'uniform', action_mode: str = 'move', actions: Optional[bytes] = None):
+		self.seed = seed
+		self.generator = generator
+		# Micro-move index (0-3) per step in 'move' mode, index into TetrisEnv.placements() per piece in 'placement' mode
+		self.action_mode = action_mode
+		self.actions = bytearray(actions or b'')
+
+	def record(self, action: int):
+		self.actions.append(int(action))
+
+	def to_bytes(self) -> bytes:
+		header = HEADER.pack(MAGIC, VERSION, GENERATOR_IDS[self.generator], ACTION_MODE_IDS[self.action_mode], self.seed, len(self.actions))
+		return header + bytes(self.actions)
+
+
+def write_episodes(path: str, episodes: list[EpisodeLog], append: bool = True):
+	with open(path, 'ab' if append else 'wb') as file:
+		for episode in episodes:
+			file.write(episode.to_bytes())
+
+
+def read_episodes(path: str) -> Iterator[EpisodeLog]:
+	generators = {v: k for k, v in GENERATOR_IDS.items()}
+	action_modes = {v: k for k, v in ACTION_MODE_IDS.items()}
+
+	with open(path, 'rb') as file:
+		data = file.read()
+
+	offset = 0
+	while offset < len(data):
+		magic, version, generator, action_mode, seed, count = HEADER.unpack_from(data, offset)
+		assert(magic == MAGIC and version == VERSION), "not an episode log: {}".format(path)
+		offset += HEADER.size
+		yield EpisodeLog(seed, generators[generator], action_modes[action_mode], data[offset:offset + count])
+		offset += count
+
+
+def resimulate(episode: EpisodeLog, reward_function: Optional[Callable[..., int]] = None, env: Optional[TetrisEnv] = None) -> dict:
+	# Replays the logged actions on a fresh headless game dealt from the same seed, without building any observations
+	if env is None or env.generator != episode.generator:
+		env = TetrisEnv(reward_function=reward_function, generator=episode.generator, compute_observations=False)
+	env.reset(seed=episode.seed)
+
+	total_reward = 0
+	info = {'score': 0, 'lines': 0, 'pieces': 0, 'steps': 0}
+	for action in episode.actions:
+		if episode.action_mode == 'placement':
+			placements, _ = env.placements()
+			_, reward, done, info = env.place(placements[action])
+		else:
+			_, reward, done, info = env.step(action)
+		total_reward += reward
+		if done:
+			break
+
+	return {'seed': episode.seed, 'score': info['score'], 'lines': info['lines'], 'pieces': info['pieces'],
+			'steps': info['steps'], 'reward': total_reward, 'finished': env.done}
+
+
+def resimulate_all(episodes: list[EpisodeLog], reward_function: Optional[Callable[..., int]] = None) -> list[dict]:
+	envs = {}
+	results = []
+	for episode in episodes:
+		env = envs.setdefault(episode.generator, TetrisEnv(reward_function=reward_function, generator=episode.generator, compute_observations=False))
+		results.append(resimulate(episode, env=env))
+	return results
+
+
+def resimulate_file(path: str, reward_function: Optional[Callable[..., int]] = None, processes: int = 1) -> list[dict]:
+	episodes = list(read_episodes(path))
+	if processes <= 1:
+		return resimulate_all(episodes, reward_function)
+
+	# Games are independent, so the log is split into one contiguous chunk per worker and results keep the file order
+	chunk = (len(episodes) + processes - 1) // processes
+	with multiprocessing.Pool(processes) as pool:
+		chunks = pool.starmap(resimulate_all, [(episodes[i:i + chunk], reward_function) for i in range(0, len(episodes), chunk)])
+	return [result for results in chunks for result in results]
+
+
+if __name__ == '__main__':
+	start = time.perf_counter()
+	results = resimulate_file(sys.argv[1], processes=int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1)
+	elapsed = time.perf_counter() - start
+
+	print('Re-simulated {} games in {:.2f} s ({:.0f} games/sec)'.format(len(results), elapsed, len(results) / max(elapsed, 1e-9)))
+	if results:
+		scores = sorted(result['score'] for result in results)
+		print('Mean score {:.1f}, best {}, mean lines {:.1f}, mean pieces {:.1f}'.format(
+			sum(scores) / len(scores), scores[-1], sum(r['lines'] for r in results) / len(results), sum(r['pieces'] for r in results) / len(results)))
@@ -0,0 +1,120 @@
+""" Parallel greedy evaluation of saved checkpoints over a fixed set of seeded headless games """
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+from inference import InferenceAgent
+from tetris_env import TetrisEnv
+
+
+# Checkpoints loaded by this worker process, keyed by path, so each one is read once per worker rather than once per game
+WORKER_AGENTS = {}
+
+
+def prepare_checkpoint(path: str, directory: str, action_mode: str = 'move', state_mode: str = 'board') -> str:
+	# Workers play from .npz exports, a Keras checkpoint is converted once here so TensorFlow is only ever imported by the parent
+	if path.endswith('.npz'):
+		return path
+	from agent import TetrisAgent
+
+	agent = TetrisAgent(action_mode=action_mode, state_mode=state_mode)
+	agent.load_model(path)
+	export = os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + '.npz')
+	agent.save_model(export)
+	return export
+
+
+def play_game(path: str, seed: int, generator: str = 'uniform', max_steps: int = 100000, max_seconds: float = 60.0) -> dict:
+	if path not in WORKER_AGENTS:
+		WORKER_AGENTS[path] = InferenceAgent(path)
+	agent = WORKER_AGENTS[path]
+
+	env = TetrisEnv(state_mode=agent.state_mode, generator=generator)
+	state_space = env.reset(seed=seed)
+	start = time.perf_counter()
+
+	# Games stop at game over or at either cap, capped games are reported so they are not mistaken for finished ones
+	done = False
+	while not done and env.steps < max_steps and time.perf_counter() - start < max_seconds:
+		if agent.action_mode == 'placement':
+			placements, afterstates = env.placements()
+			if not placements:
+				# Running out of placements ends the game, as in rl_tetris
+				done = True
+				break
+			state_space, _, done, _ = env.place(placements[agent.select_placement(afterstates)])
+		else:
+			state_space, _, done, _ = env.step(agent.epsilon_greedy_selection(state_space.reshape(1, -1)))
+
+	return {'seed': seed, 'score': env.score, 'lines': env.lines, 'pieces': env.pieces, 'steps': env.steps,
+			'seconds': time.perf_counter() - start, 'capped': not done}
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+	scores = np.array([result['score'] for result in results])
+	return {'games': len(results), 'mean_score': float(scores.mean()), 'median_score': float(np.median(scores)), 'p95_score': float(np.percentile(scores, 95)),
+			'best_score': int(scores.max()), 'mean_lines': float(np.mean([result['lines'] for result in results])),
+			'mean_pieces': float(np.mean([result['pieces'] for result in results])), 'capped': sum(result['capped'] for result in results),
+			'games_per_sec': len(results) / max(elapsed, 1e-9)}
+
+
+def evaluate(checkpoints: list[str], games: int = 100, seed: int = 0, generator: str = 'uniform', processes: Optional[int] = None,
+			 max_steps: int = 100000, max_seconds: float = 60.0, stats_path: Optional[str] = None, action_mode: str = 'move', state_mode: str = 'board') -> dict:
+	# Every checkpoint plays the same seeds, so differences come from the policy and not from the pieces dealt
+	# action_mode and state_mode only apply to Keras checkpoints, .npz exports carry their own
+	seeds = list(range(seed, seed + games))
+	processes = processes or os.cpu_count() or 1
+
+	stats = None
+	if stats_path is not None:
+		from stats_store import StatsStore
+		stats = StatsStore(stats_path, highscore_path=None)
+
+	report = {}
+	with tempfile.TemporaryDirectory() as directory, multiprocessing.Pool(processes) as pool:
+		for checkpoint in checkpoints:
+			path = prepare_checkpoint(checkpoint, directory, action_mode=action_mode, state_mode=state_mode)
+			start = time.perf_counter()
+			results = pool.starmap(play_game, [(path, game_seed, generator, max_steps, max_seconds) for game_seed in seeds], chunksize=max(1, games // (4 * processes)))
+			report[checkpoint] = summarize(results, time.perf_counter() - start)
+
+			if stats is not None:
+				for result in results:
+					stats.record_episode(score=result['score'], lines=result['lines'], pieces=result['pieces'], duration=result['seconds'],
+										 mode='eval', agent_version=os.path.basename(checkpoint))
+	if stats is not None:
+		stats.close()
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('checkpoints', nargs='+', help='.npz exports or Keras checkpoints saved by TetrisAgent.save_model')
+	parser.add_argument('--games', type=int, default=100, help='games per checkpoint')
+	parser.add_argument('--seed', type=int, default=0, help='first seed of the fixed seed set')
+	parser.add_argument('--generator', default='uniform', choices=('uniform', 'bag'))
+	parser.add_argument('--processes', type=int, default=None, help='worker processes, all cores by default')
+	parser.add_argument('--max-steps', type=int, default=100000, help='step cap per game')
+	parser.add_argument('--max-seconds', type=float, default=60.0, help='wall-clock cap per game')
+	parser.add_argument('--action-mode', default='move', choices=('move', 'placement'), help='action mode of Keras checkpoints')
+	parser.add_argument('--state-mode', default='board', choices=('board', 'features'), help='state mode of Keras checkpoints')
+	parser.add_argument('--stats', default=None, help='also record every game in this StatsStore database')
+	parser.add_argument('--json', default=None, help='write the report to this file')
+	args = parser.parse_args()
+
+	report = evaluate(args.checkpoints, games=args.games, seed=args.seed, generator=args.generator, processes=args.processes,
+					  max_steps=args.max_steps, max_seconds=args.max_seconds, stats_path=args.stats,
+					  action_mode=args.action_mode, state_mode=args.state_mode)
+	for checkpoint, summary in report.items():
+		print('{}: {} games, score mean {:.1f} median {:.1f} p95 {:.1f} best {}, lines {:.1f}, pieces {:.1f}, {} capped, {:.1f} games/sec'.format(
+			checkpoint, summary['games'], summary['mean_score'], summary['median_score'], summary['p95_score'], summary['best_score'],
+			summary['mean_lines'], summary['mean_pieces'], summary['capped'], summary['games_per_sec']))
+	if args.json is not None:
+		with open(args.json, 'w') as file:
+			json.dump(report, file, indent=2)
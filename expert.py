@@ -0,0 +1,159 @@
+""" Heuristic expert player scoring placements with weighted board features, for bulk demonstrations and pretraining """
+import multiprocessing
+import os
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+
+from bitboard import BitBoard
+from piece import Piece
+from state_encoder import board_features
+from tetris_env import TetrisEnv
+
+
+# Weights of aggregate height, completed lines, holes and bumpiness from the classic hand-tuned Tetris evaluation
+DEFAULT_WEIGHTS = {'aggregate_height': -0.510066, 'lines': 0.760666, 'holes': -0.35663, 'bumpiness': -0.184483}
+
+# Demonstrations use the actor/learner layout: packed boards, actions, rows cleared (rewards are applied by the agent) and terminals
+DEMONSTRATION_FIELDS = ('states', 'actions', 'rows_cleared', 'states_prime', 'terminals')
+
+
+class HeuristicPlayer:
+	def __init__(self, weights: Optional[dict] = None):
+		self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+
+	def score(self, row_masks: list[list[int]], rows_cleared: list[int], columns: int = 10) -> np.ndarray:
+		# All afterstates of one decision are expanded to cells and featurised in one vectorized pass
+		cells = (np.array(row_masks, dtype=np.int64)[:, :, None] >> np.arange(columns)) & 1
+		features = board_features(cells)
+		return (self.weights['aggregate_height'] * features[:, columns] + self.weights['lines'] * np.asarray(rows_cleared)
+				+ self.weights['holes'] * features[:, columns + 1] + self.weights['bumpiness'] * features[:, columns + 2])
+
+	def evaluate(self, board: BitBoard, piece: Piece) -> tuple[list[tuple], list[tuple], np.ndarray]:
+		# Every placement of the piece with its (afterstate, rows cleared) and heuristic score
+		placements = board.placements(piece)
+		if not placements:
+			return placements, [], np.zeros(0)
+		afterstates = [board.afterstate(piece, placement) for placement in placements]
+		return placements, afterstates, self.score([afterstate.board for afterstate, _ in afterstates], [rows for _, rows in afterstates], board.columns)
+
+	def choose(self, board: BitBoard, piece: Piece) -> Optional[int]:
+		# Index into board.placements(piece) of the best scoring placement, None when there is none
+		_, _, scores = self.evaluate(board, piece)
+		return int(np.argmax(scores)) if len(scores) else None
+
+
+def play_placement_game(player: HeuristicPlayer, env: TetrisEnv, seed: int, max_pieces: int) -> list[tuple]:
+	# Transitions link each chosen afterstate to the next chosen one, as in rl_tetris.play_placement_episode (action 0)
+	env.reset(seed=seed)
+	transitions = []
+	pending = None
+	done = False
+	while not done and env.pieces < max_pieces:
+		placements, afterstates, scores = player.evaluate(env.board, env.current_piece)
+		if not placements:
+			break
+		# Only the chosen afterstate is ever stored, so it is the only one encoded
+		index = int(np.argmax(scores))
+		afterstate = env.encoder.encode_row_masks([afterstates[index][0].board])[0]
+		if pending is not None:
+			transitions.append((pending[0], 0, pending[1], afterstate, False))
+		_, _, done, info = env.place(placements[index])
+		pending = (afterstate, info['rows_cleared'])
+
+	if pending is not None:
+		# A game stopped by the piece cap is not a game over, it simply ends without a successor
+		transitions.append((pending[0], 0, pending[1], pending[0], env.pieces < max_pieces))
+	return transitions
+
+
+def play_move_game(player: HeuristicPlayer, env: TetrisEnv, seed: int, max_pieces: int) -> list[tuple]:
+	# Each piece is steered to the expert's placement with micro-moves: rotate, shift, then soft drop until it locks
+	state_space = env.reset(seed=seed)
+	transitions = []
+	done = False
+	while not done and env.pieces < max_pieces:
+		piece = env.current_piece
+		placements, _, scores = player.evaluate(env.board, piece)
+		if not placements:
+			break
+		rotation, x, _ = placements[int(np.argmax(scores))]
+
+		locked = False
+		while not locked and not done:
+			if piece.rotation % len(piece.shape) != rotation:
+				action = 3
+			elif piece.x != x:
+				action = 0 if piece.x > x else 1
+			else:
+				action = 2
+			state_space_prime, _, done, info = env.step(action)
+			transitions.append((state_space, action, info['rows_cleared'], state_space_prime, done))
+			state_space, locked = state_space_prime, info['locked']
+	return transitions
+
+
+def generate_games(seeds: list[int], action_mode: str = 'placement', max_pieces: int = 1000, weights: Optional[dict] = None) -> dict:
+	# Worker entry point, returns the transitions of all its games as packed arrays
+	player = HeuristicPlayer(weights)
+	# Placement games encode afterstates themselves, env observations are only needed for micro-move states
+	env = TetrisEnv(compute_observations=action_mode != 'placement')
+	play = play_placement_game if action_mode == 'placement' else play_move_game
+
+	transitions = [transition for seed in seeds for transition in play(player, env, seed, max_pieces)]
+	if not transitions:
+		return {field: np.zeros(0) for field in DEMONSTRATION_FIELDS}
+	states, actions, rows_cleared, states_prime, terminals = zip(*transitions)
+	return {'states': np.packbits(np.array(states, dtype=np.uint8), axis=1), 'actions': np.array(actions, dtype=np.int64),
+			'rows_cleared': np.array(rows_cleared, dtype=np.int64), 'states_prime': np.packbits(np.array(states_prime, dtype=np.uint8), axis=1),
+			'terminals': np.array(terminals, dtype=bool)}
+
+
+def generate_demonstrations(games: int, action_mode: str = 'placement', seed: int = 0, processes: Optional[int] = None,
+							max_pieces: int = 1000, weights: Optional[dict] = None, path: Optional[str] = None) -> dict:
+	# Games are split into one contiguous chunk of seeds per worker, as in episode_log.resimulate_file
+	processes = processes or os.cpu_count() or 1
+	seeds = list(range(seed, seed + games))
+	chunk = (games + processes - 1) // processes
+	chunks = [(seeds[i:i + chunk], action_mode, max_pieces, weights) for i in range(0, games, chunk)]
+	if processes <= 1:
+		results = [generate_games(*arguments) for arguments in chunks]
+	else:
+		# Spawned (not forked) workers, callers such as rl_tetris have already initialised TensorFlow, whose threads do not survive a fork
+		with multiprocessing.get_context('spawn').Pool(processes) as pool:
+			results = pool.starmap(generate_games, chunks)
+
+	demonstrations = {field: np.concatenate([result[field] for result in results if len(result[field])]) for field in DEMONSTRATION_FIELDS}
+	if path is not None:
+		np.savez(path, **demonstrations)
+	return demonstrations
+
+
+def load_demonstrations(path: str) -> dict:
+	with np.load(path) as data:
+		return {field: data[field] for field in DEMONSTRATION_FIELDS}
+
+
+def pretrain(player, demonstrations: dict, train_steps: int = 0, mini_batch_size: int = 1000):
+	# Seed the agent's replay memory with expert transitions, then optionally fit the network on them before RL starts
+	# Rewards come from the agent's own reward function, so demonstrations stay valid when the reward constants change
+	terminals = demonstrations['terminals'].astype(bool)
+	rewards = player.batch_reward_function(rows_cleared=demonstrations['rows_cleared'], terminal=terminals)
+	player.update_replay_buffer_batch(demonstrations['states'], demonstrations['actions'], rewards, demonstrations['states_prime'], terminals, packed=True)
+	for _ in range(train_steps):
+		player.train(mini_batch_size=mini_batch_size, epochs=1)
+
+
+if __name__ == '__main__':
+	games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+	action_mode = sys.argv[2] if len(sys.argv) > 2 else 'placement'
+	path = sys.argv[3] if len(sys.argv) > 3 else None
+
+	start = time.perf_counter()
+	demonstrations = generate_demonstrations(games, action_mode=action_mode, path=path)
+	elapsed = time.perf_counter() - start
+	count = len(demonstrations['actions'])
+	print('Generated {} {} transitions from {} games in {:.2f} s ({:.0f} transitions/hour), mean lines per game {:.1f}'.format(
+		count, action_mode, games, elapsed, count / max(elapsed, 1e-9) * 3600, demonstrations['rows_cleared'].sum() / games))
@@ -0,0 +1,100 @@
+""" Lightweight NumPy forward pass over exported Dense weights, for low-latency action selection and TensorFlow-free evaluation """
+import json
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'softmax': lambda x: (lambda e: e / e.sum(axis=-1, keepdims=True))(np.exp(x - x.max(axis=-1, keepdims=True))),
+}
+
+
+class NumpyQNetwork:
+    def __init__(self, weights: list[np.ndarray], activations: list[str]):
+        # weights alternate kernel, bias for each Dense layer, as returned by tf.keras.Model.get_weights()
+        assert(len(weights) == 2 * len(activations))
+        self.layers = [(weights[2 * i].astype(np.float32), weights[2 * i + 1].astype(np.float32), ACTIVATIONS[activation])
+                       for i, activation in enumerate(activations)]
+
+    def __call__(self, state_spaces: np.ndarray) -> np.ndarray:
+        x = np.asarray(state_spaces, dtype=np.float32).reshape(-1, self.layers[0][0].shape[0])
+        for kernel, bias, activation in self.layers:
+            x = activation(x @ kernel + bias)
+        return x
+
+
+def export_weights(path: str, weights: list[np.ndarray], activations: list[str], **meta):
+    # Compact .npz holding the Dense kernels and biases as float32, plus the activations and any agent settings as JSON
+    arrays = {'weight_{}'.format(i): np.asarray(weight, dtype=np.float32) for i, weight in enumerate(weights)}
+    np.savez(path, meta=np.array(json.dumps(dict(meta, activations=activations))), **arrays)
+
+
+def load_weights(path: str) -> tuple[list[np.ndarray], dict]:
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        weights = [data['weight_{}'.format(i)] for i in range(2 * len(meta['activations']))]
+    return weights, meta
+
+
+class InferenceAgent:
+    # Plays from a file written by TetrisAgent.save_model(path.npz) with the same action selection interface, without importing TensorFlow
+    def __init__(self, path: str = './dql_tetris.npz', epsilon: float = 0.0, seed: Optional[int] = None):
+        weights, meta = load_weights(path)
+        self.network = NumpyQNetwork(weights=weights, activations=meta['activations'])
+        self.action_mode = meta.get('action_mode', 'move')
+        self.state_mode = meta.get('state_mode', 'board')
+
+        # Greedy by default, evaluation should not explore
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng(seed)
+
+    def state_action_q_values(self, state_space: np.ndarray) -> np.ndarray:
+        return self.network(state_space)
+
+    def epsilon_greedy_selection(self, state_space: np.ndarray) -> int:
+        if self.rng.uniform(0, 1) < self.epsilon:
+            return int(self.rng.integers(4))
+        return int(np.argmax(self.network(state_space)))
+
+    def batch_epsilon_greedy_selection(self, state_spaces: np.ndarray) -> np.ndarray:
+        actions = np.argmax(self.network(state_spaces), axis=1)
+        explore = self.rng.uniform(0, 1, size=len(actions)) < self.epsilon
+        actions[explore] = self.rng.integers(4, size=int(explore.sum()))
+        return actions
+
+    def select_placement(self, afterstates: np.ndarray) -> int:
+        if self.rng.uniform(0, 1) < self.epsilon:
+            return int(self.rng.integers(len(afterstates)))
+        return int(np.argmax(self.network(afterstates)[:, 0]))
+
+
+def measure_latency(q_function: Callable[[np.ndarray], np.ndarray], state_spaces: np.ndarray, trials: int = 200) -> dict:
+    # Warm up once so one-off tracing or allocation cost is not attributed to every decision
+    q_function(state_spaces)
+
+    latencies = np.zeros(trials)
+    for i in range(trials):
+        start = time.perf_counter()
+        q_function(state_spaces)
+        latencies[i] = time.perf_counter() - start
+    return {'mean_ms': latencies.mean() * 1000, 'p50_ms': np.percentile(latencies, 50) * 1000,
+            'p95_ms': np.percentile(latencies, 95) * 1000, 'per_state_us': latencies.mean() * 1e6 / len(state_spaces)}
+
+
+if __name__ == '__main__':
+    from agent import TetrisAgent
+
+    agent = TetrisAgent()
+    single = np.random.randint(0, 2, size=(1, 200)).astype(np.float32)
+    batch = np.random.randint(0, 2, size=(256, 200)).astype(np.float32)
+
+    for mode in ('predict', 'function', 'numpy'):
+        agent.set_inference_mode(mode)
+        for name, states in (('single', single), ('batch of 256', batch)):
+            result = measure_latency(agent.state_action_q_values, states, trials=50 if mode == 'predict' else 500)
+            print('{:<8} {:<12} mean {:.3f} ms  p50 {:.3f} ms  p95 {:.3f} ms  {:.1f} us/state'.format(
+                mode, name, result['mean_ms'], result['p50_ms'], result['p95_ms'], result['per_state_us']))
@@ -0,0 +1,105 @@
+""" Locked-cell store for the windowed game: a {(x, y): colour} dict that keeps per-row fill counters for fast line clears """
+from bisect import bisect_right
+from typing import Optional
+
+
+class LockedPositions(dict):
+	# Drop-in replacement for the plain locked_positions dict, every write goes through __setitem__ / __delitem__ to keep the counters exact
+	def __init__(self, rows: int = 20, columns: int = 10, positions: Optional[dict] = None):
+		super().__init__()
+		self.rows = rows
+		self.columns = columns
+
+		# Locked cells per board row, a row is full when its counter reaches `columns`
+		self.row_counts = [0] * rows
+		# Locked cells in the top row or above the board, any of them ends the game (same rule as Tetris.check_loss)
+		self.top_cells = 0
+		# A cell locked above the board ends the game for good, even once a clear shifts it down (as in BitBoard and VectorTetris)
+		self.overflowed = False
+
+		if positions:
+			self.update(positions)
+
+	def count(self, y: int, change: int):
+		if 0 <= y < self.rows:
+			self.row_counts[y] += change
+		if y < 1:
+			self.top_cells += change
+		if y < 0 and change > 0:
+			self.overflowed = True
+
+	def __setitem__(self, key: tuple, colour: tuple):
+		if key not in self:
+			self.count(key[1], 1)
+		super().__setitem__(key, colour)
+
+	def __delitem__(self, key: tuple):
+		super().__delitem__(key)
+		self.count(key[1], -1)
+
+	def pop(self, key: tuple, *default):
+		if key in self:
+			self.count(key[1], -1)
+		return super().pop(key, *default)
+
+	def update(self, positions: dict = (), **kwargs):
+		for key, colour in dict(positions, **kwargs).items():
+			self[key] = colour
+
+	# The dict versions of these write around __setitem__ / __delitem__ and would leave the counters stale
+	def setdefault(self, key: tuple, colour: Optional[tuple] = None) -> tuple:
+		if key not in self:
+			self[key] = colour
+		return super().__getitem__(key)
+
+	def popitem(self) -> tuple:
+		key, colour = super().popitem()
+		self.count(key[1], -1)
+		return key, colour
+
+	def __ior__(self, positions: dict) -> 'LockedPositions':
+		self.update(positions)
+		return self
+
+	def clear(self):
+		super().clear()
+		self.row_counts = [0] * self.rows
+		self.top_cells = 0
+		self.overflowed = False
+
+	def copy(self) -> 'LockedPositions':
+		locked = LockedPositions(self.rows, self.columns, self)
+		locked.overflowed = self.overflowed
+		return locked
+
+	def full_rows(self) -> list[int]:
+		# O(1) per row thanks to the counters, in top-to-bottom order
+		return [y for y, count in enumerate(self.row_counts) if count >= self.columns]
+
+	def topped_out(self) -> bool:
+		return self.overflowed or self.top_cells > 0
+
+	def clear_rows(self) -> int:
+		# Remove every full row, contiguous or not, and drop each remaining cell by the number of cleared rows below it in one pass
+		cleared = self.full_rows()
+		if not cleared:
+			return 0
+
+		# The counters are rebuilt from the shifted cells, cells above the board can move into it and have no counter to move with
+		cleared_set = set(cleared)
+		shifted = {}
+		row_counts = [0] * self.rows
+		top_cells = 0
+		for (x, y), colour in self.items():
+			if y not in cleared_set:
+				y += len(cleared) - bisect_right(cleared, y)
+				shifted[(x, y)] = colour
+				if 0 <= y < self.rows:
+					row_counts[y] += 1
+				top_cells += y < 1
+		super().clear()
+		super().update(shifted)
+
+		self.row_counts = row_counts
+		self.top_cells = top_cells
+		return len(cleared)
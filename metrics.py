@@ -0,0 +1,135 @@
+""" Training throughput instrumentation: per-phase timers, rates, memory usage, structured logs and profiling hooks """
+import cProfile
+import csv
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, memory usage is then only read from /proc when present
+    resource = None
+
+
+PHASES = ('env_step', 'encode', 'inference', 'replay_insert', 'train_step', 'render')
+
+# CSV columns are fixed by the first row, these are reserved even if that row does not carry them (e.g. TetrisAgent.replay_stats)
+CSV_EXTRA_FIELDS = ('replay_size', 'replay_fill', 'replay_mb', 'dropped_transitions')
+
+
+def memory_usage_mb() -> float:
+    # Current resident set size where /proc is available, peak resident set size otherwise
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+class TrainingMetrics:
+    def __init__(self, path: Optional[str] = None, log_every: int = 1000, profile_steps: int = 0, profile_path: str = './profile.out', verbose: bool = True):
+        # Rows go to `path` as JSON lines, or as CSV when the path ends in .csv
+        self.path = path
+        self.log_every = log_every
+        self.verbose = verbose
+        self.csv_fields = None
+
+        self.phase_times = {phase: 0.0 for phase in PHASES}
+        self.steps = 0
+        self.transitions = 0
+        self.episodes = 0
+        self.start_time = time.perf_counter()
+        self.last_log_time = self.start_time
+        self.last_log_steps = 0
+        self.last_log_transitions = 0
+
+        # Optional cProfile session covering the first `profile_steps` steps
+        self.profile_steps = profile_steps
+        self.profile_path = profile_path
+        self.profiler = None
+        if profile_steps > 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        self.phase_times[name] = self.phase_times.get(name, 0.0) + seconds
+
+    def step(self, steps: int = 1, transitions: int = 0, **extra) -> Optional[dict]:
+        self.steps += steps
+        self.transitions += transitions
+
+        if self.profiler is not None and self.steps >= self.profile_steps:
+            self.stop_profile()
+        if self.steps - self.last_log_steps >= self.log_every:
+            return self.log(**extra)
+        return None
+
+    def end_episode(self, **extra) -> dict:
+        self.episodes += 1
+        return self.log(**extra)
+
+    def log(self, **extra) -> dict:
+        now = time.perf_counter()
+        interval = max(now - self.last_log_time, 1e-9)
+        steps = self.steps - self.last_log_steps
+
+        row = {'time': round(now - self.start_time, 3), 'episodes': self.episodes, 'steps': self.steps, 'transitions': self.transitions,
+               'steps_per_sec': round(steps / interval, 1),
+               'transitions_per_sec': round((self.transitions - self.last_log_transitions) / interval, 1),
+               'rss_mb': round(memory_usage_mb(), 1)}
+        # Milliseconds spent per step in each phase since the last row, phases may nest (env_step includes encode)
+        for phase, seconds in self.phase_times.items():
+            row[phase + '_ms'] = round(seconds * 1000 / max(steps, 1), 4)
+        row.update(extra)
+
+        self.write(row)
+        if self.verbose:
+            print(' '.join('{}={}'.format(key, value) for key, value in row.items()))
+
+        self.phase_times = {phase: 0.0 for phase in self.phase_times}
+        self.last_log_time = now
+        self.last_log_steps = self.steps
+        self.last_log_transitions = self.transitions
+        return row
+
+    def write(self, row: dict):
+        if self.path is None:
+            return
+        if self.path.endswith('.csv'):
+            new_file = not os.path.exists(self.path)
+            if self.csv_fields is None:
+                self.csv_fields = list(row) + [field for field in CSV_EXTRA_FIELDS if field not in row]
+            with open(self.path, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=self.csv_fields, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+        else:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(row) + '\n')
+
+    def stop_profile(self, top: int = 25):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_path)
+        if self.verbose:
+            pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(top)
+        self.profiler = None
@@ -96,14 +96,49 @@ SHAPE_LOOKUP = {"S": ([['.....',
                        '..0..',
                        '.....']], (128, 0, 128))}
 
+SHAPE_START_POS = {'S': (5, 2), 'Z': (5, 2), 'I': (5, 3), 'O': (5, 2), 'J': (5, 3), 'L': (5, 3), 'T': (5, 3)}
+
+
+def compile_shape_offsets() -> dict:
+    # Parse each 5x5 template once into (dx, dy) offsets from (piece.x, piece.y), in the row-major order of the template
+    # The (-2, -4) shift is the accomodation for the offset in the piece shape format definition
+    offsets = {}
+    for name, (rotations, _) in SHAPE_LOOKUP.items():
+        offsets[name] = tuple(tuple((j - 2, i - 4) for i, row in enumerate(shape_format) for j, column in enumerate(row) if column == '0')
+                              for shape_format in rotations)
+    return offsets
+
+
+SHAPE_OFFSETS = compile_shape_offsets()
+
+# (min dx, max dx, min dy, max dy) of every (shape, rotation), relative to (piece.x, piece.y)
+SHAPE_BOUNDS = {name: tuple((min(dx for dx, _ in cells), max(dx for dx, _ in cells), min(dy for _, dy in cells), max(dy for _, dy in cells))
+                            for cells in rotations)
+                for name, rotations in SHAPE_OFFSETS.items()}
+
+
+def cell_offsets(shape: str, rotation: int = 0) -> tuple:
+    rotations = SHAPE_OFFSETS[shape]
+    return rotations[rotation % len(rotations)]
+
+
+def bounding_box(shape: str, rotation: int = 0) -> tuple:
+    rotations = SHAPE_BOUNDS[shape]
+    return rotations[rotation % len(rotations)]
+
 
 class Piece(object):
     def __init__(self, shape: str):
+       self.name = shape
        self.shape = SHAPE_LOOKUP[shape][0]
        self.colour = SHAPE_LOOKUP[shape][1]
 
-       shape_start_pos = {'S': (5, 2), 'Z': (5, 2), 'I': (5, 3), 'O': (5, 2), 'J': (5, 3), 'L': (5, 3), 'T': (5, 3)}
-
-       self.x = shape_start_pos[shape][0]
-       self.y = shape_start_pos[shape][1]
+       self.x = SHAPE_START_POS[shape][0]
+       self.y = SHAPE_START_POS[shape][1]
        self.rotation = 0
+
+    def cells(self, x: int = None, y: int = None, rotation: int = None) -> list[tuple]:
+       # Board positions of the piece, optionally at another placement, as a translation of the cached offsets
+       x = self.x if x is None else x
+       y = self.y if y is None else y
+       return [(x + dx, y + dy) for dx, dy in cell_offsets(self.name, self.rotation if rotation is None else rotation)]
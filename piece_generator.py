@@ -0,0 +1,41 @@
+""" Seeded piece generators deciding the order in which shapes are dealt """
+import random
+from typing import Optional
+
+
+class UniformGenerator:
+	# Every shape is equally likely on every draw, as with the original random.choice
+	def __init__(self, shapes: list[str], seed: Optional[int] = None):
+		self.shapes = list(shapes)
+		self.rng = random.Random(seed)
+
+	def seed(self, seed: Optional[int] = None):
+		self.rng.seed(seed)
+
+	def next(self) -> str:
+		return self.rng.choice(self.shapes)
+
+
+class BagGenerator(UniformGenerator):
+	# 7-bag: each shape is dealt once, in a shuffled order, before the bag is refilled
+	def __init__(self, shapes: list[str], seed: Optional[int] = None):
+		super().__init__(shapes, seed)
+		self.bag = []
+
+	def seed(self, seed: Optional[int] = None):
+		super().seed(seed)
+		self.bag = []
+
+	def next(self) -> str:
+		if not self.bag:
+			self.bag = list(self.shapes)
+			self.rng.shuffle(self.bag)
+		return self.bag.pop()
+
+
+GENERATORS = {'uniform': UniformGenerator, 'bag': BagGenerator}
+
+
+def make_generator(kind: str, shapes: list[str], seed: Optional[int] = None) -> UniformGenerator:
+	assert(kind in GENERATORS)
+	return GENERATORS[kind](shapes, seed)
@@ -0,0 +1,92 @@
+""" Lookahead beam search over piece placements, scoring afterstates with the Q-network and the next-piece preview """
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from bitboard import BitBoard
+from piece import Piece
+from state_encoder import StateEncoder
+
+
+class BeamSearchPlanner:
+	def __init__(self, q_function: Callable[[np.ndarray], np.ndarray], reward_function: Callable[..., int], encoder: Optional[StateEncoder] = None,
+				 beam_width: int = 8, depth: int = 2, gamma: float = 0.8, time_budget: float = 0.05, cache_size: int = 200000):
+		# `q_function` maps a batch of encoded afterstates to network outputs, the first output being the afterstate value (placement mode)
+		self.q_function = q_function
+		self.reward_function = reward_function
+		self.encoder = encoder or StateEncoder()
+
+		# Only the current piece and the previewed next piece are known, so lookahead is capped at the pieces passed to plan()
+		self.beam_width = beam_width
+		self.depth = depth
+		self.gamma = gamma
+
+		# Seconds allowed per decision, the best placement found so far is returned once it runs out
+		self.time_budget = time_budget
+
+		# Afterstate values keyed by the board's row masks, reused across decisions until the network changes
+		self.cache_size = cache_size
+		self.cache = {}
+		self.stats = {'decisions': 0, 'evaluated': 0, 'cache_hits': 0, 'timeouts': 0}
+
+	def clear_cache(self):
+		# Must be called whenever the network's weights change, cached values would otherwise be stale
+		self.cache = {}
+
+	def evaluate(self, boards: list[BitBoard]) -> np.ndarray:
+		# Values of many afterstates, with every board missing from the cache scored in one batched forward pass
+		keys = [tuple(board.board) for board in boards]
+		missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+		self.stats['cache_hits'] += len(keys) - len(missing)
+		if missing:
+			if len(self.cache) + len(missing) > self.cache_size:
+				self.cache = {}
+			values = self.q_function(self.encoder.encode_row_masks(missing))[:, 0]
+			self.cache.update(zip(missing, values.tolist()))
+			self.stats['evaluated'] += len(missing)
+		return np.array([self.cache[key] for key in keys])
+
+	def plan(self, board: BitBoard, pieces: list[Piece]) -> Optional[int]:
+		# Index into board.placements(pieces[0]) of the placement leading to the best leaf, None when the piece cannot be placed
+		# pieces[0] is the current piece and pieces[1] the previewed next one, each dropped from its own current row
+		start = time.perf_counter()
+		self.stats['decisions'] += 1
+
+		# Nodes are (root placement index, board, discounted reward before this placement, discount, reward of this placement, terminal)
+		# An afterstate's value already includes the reward of the placement that produced it, as in TetrisAgent.select_placement
+		beam = [(None, board, 0.0, 1.0, 0.0, False)]
+		best = None
+		for level, piece in enumerate(pieces[:max(1, self.depth)]):
+			following = pieces[level + 1] if level + 1 < len(pieces) else None
+			children = []
+			for root, node_board, total, discount, reward, _ in beam:
+				total += discount * reward
+				discount = discount if root is None else discount * self.gamma
+				for index, placement in enumerate(node_board.placements(piece)):
+					child, rows_cleared = node_board.afterstate(piece, placement)
+					# A previewed piece with nowhere to spawn ends the game as surely as a locked cell in the top row
+					terminal = child.check_loss() or (following is not None and not child.valid_space(following))
+					children.append((index if root is None else root, child, total, discount, self.reward_function(rows_cleared=rows_cleared, terminal=terminal), terminal))
+				if time.perf_counter() - start > self.time_budget:
+					break
+			if not children:
+				break
+
+			totals, discounts, rewards, terminals = (np.array(column) for column in zip(*[node[2:] for node in children]))
+			leaf_values = rewards.astype(np.float64)
+			if not terminals.all():
+				leaf_values[~terminals] = self.evaluate([node[1] for node in children if not node[5]])
+			scores = totals + discounts * leaf_values
+
+			# Stable ordering keeps ties on the lowest placement index, like np.argmax in TetrisAgent.select_placement
+			order = np.argsort(-scores, kind='stable')[:self.beam_width]
+			best = children[order[0]][0]
+			beam = [children[i] for i in order if not children[i][5]]
+
+			if time.perf_counter() - start > self.time_budget:
+				self.stats['timeouts'] += 1
+				break
+			if not beam:
+				break
+		return best
@@ -0,0 +1,131 @@
+""" Dirty-rectangle renderer drawing the Tetris board with cached fonts and a pre-rendered static background """
+import pygame
+
+from piece import Piece
+from tetris import Tetris
+
+
+class TetrisRenderer:
+	def __init__(self, tetris: Tetris, surface, render_every: int = 1, font_path: str = './arcade.TTF'):
+		self.tetris = tetris
+		self.surface = surface
+
+		# Only every `render_every`-th call to render() draws anything, so watching training costs a fraction of the frames
+		self.render_every = max(1, render_every)
+		self.frame = 0
+
+		pygame.font.init()
+		self.font_path = font_path
+		self.fonts = {}
+
+		self.next_x = tetris.grid_top_left_x + tetris.game_width + 50
+		self.next_y = tetris.grid_top_left_y + ((tetris.game_height / 2) - 100)
+		self.score_pos = (self.next_x, self.next_y + 200)
+		self.high_score_pos = (tetris.grid_top_left_x - 240 + 20, tetris.grid_top_left_y + 200 + 200)
+
+		self.background = self.draw_background()
+		self.last_grid = None
+		self.last_labels = {}
+		self.last_next = None
+		self.full_redraw = True
+
+	def font(self, size: int) -> pygame.font.Font:
+		if size not in self.fonts:
+			self.fonts[size] = pygame.font.Font(self.font_path, size)
+		return self.fonts[size]
+
+	def draw_background(self) -> pygame.Surface:
+		# Everything that never changes: title, next shape caption, empty board with its grid lines and border
+		tetris = self.tetris
+		background = pygame.Surface((tetris.window_width, tetris.window_height))
+		background.fill((0, 0, 0))
+
+		label = self.font(65).render("TETRIS", 1, (255, 255, 255))
+		background.blit(label, ((tetris.grid_top_left_x + (tetris.game_width / 2)) - (label.get_width() / 2), 30))
+		background.blit(self.font(30).render("Next Shape", 1, (255, 255, 255)), (self.next_x, self.next_y - 30))
+
+		tetris.draw_grid(background)
+		pygame.draw.rect(background, (255, 255, 255), (tetris.grid_top_left_x, tetris.grid_top_left_y, tetris.game_width, tetris.game_height), 4)
+		return background
+
+	def cell_rect(self, row: int, col: int) -> pygame.Rect:
+		tetris = self.tetris
+		return pygame.Rect(tetris.grid_top_left_x + col * tetris.block_size, tetris.grid_top_left_y + row * tetris.block_size, tetris.block_size, tetris.block_size)
+
+	def draw_cell(self, row: int, col: int, colour: tuple) -> pygame.Rect:
+		# Fill the cell and restore its grid lines, the border is redrawn once per frame afterwards
+		rect = self.cell_rect(row, col)
+		pygame.draw.rect(self.surface, colour, rect, 0)
+		pygame.draw.line(self.surface, (0, 0, 0), rect.topleft, rect.topright)
+		pygame.draw.line(self.surface, (0, 0, 0), rect.topleft, rect.bottomleft)
+		return rect
+
+	def draw_label(self, key: str, text: str, position: tuple) -> list:
+		# Re-render a text label only when its contents change, returning the rects that need updating
+		if self.last_labels.get(key, (None, None))[0] == text:
+			return []
+
+		dirty = []
+		if key in self.last_labels:
+			old_rect = self.last_labels[key][1]
+			self.surface.blit(self.background, old_rect, old_rect)
+			dirty.append(old_rect)
+
+		rect = self.surface.blit(self.font(30).render(text, 1, (255, 255, 255)), position)
+		self.last_labels[key] = (text, rect)
+		return dirty + [rect]
+
+	def draw_next_shape(self, piece: Piece) -> list:
+		key = (piece.name, piece.rotation)
+		if key == self.last_next:
+			return []
+		self.last_next = key
+
+		block_size = self.tetris.block_size
+		area = pygame.Rect(self.next_x, self.next_y, 5 * block_size, 5 * block_size)
+		self.surface.fill((0, 0, 0), area)
+		for dx, dy in piece.cells(x=2, y=4):
+			pygame.draw.rect(self.surface, piece.colour, (self.next_x + dx * block_size, self.next_y + dy * block_size, block_size, block_size), 0)
+		return [area]
+
+	def render(self, grid: list[list[tuple]], score: int = 0, high_score: int = 0, next_piece: Piece = None, force: bool = False) -> bool:
+		self.frame += 1
+		if not force and self.frame % self.render_every != 0:
+			return False
+
+		dirty = []
+		if self.full_redraw:
+			self.surface.blit(self.background, (0, 0))
+			self.last_labels, self.last_next = {}, None
+
+		for row in range(self.tetris.rows):
+			for col in range(self.tetris.columns):
+				colour = grid[row][col]
+				if self.full_redraw or self.last_grid[row][col] != colour:
+					dirty.append(self.draw_cell(row, col, colour))
+		self.last_grid = [list(row) for row in grid]
+
+		if dirty:
+			tetris = self.tetris
+			pygame.draw.rect(self.surface, (255, 255, 255), (tetris.grid_top_left_x, tetris.grid_top_left_y, tetris.game_width, tetris.game_height), 4)
+
+		dirty += self.draw_label('score', 'SCORE    {}'.format(score), self.score_pos)
+		dirty += self.draw_label('high_score', 'HIGHSCORE    {}'.format(high_score), self.high_score_pos)
+		if next_piece is not None:
+			dirty += self.draw_next_shape(next_piece)
+
+		if self.full_redraw:
+			pygame.display.update()
+			self.full_redraw = False
+		elif dirty:
+			pygame.display.update(dirty)
+		return True
+
+	def draw_text_middle(self, text: str, size: int, colour: tuple):
+		tetris = self.tetris
+		label = self.font(size).render(text, 1, colour)
+		self.surface.blit(label, (tetris.grid_top_left_x + (tetris.game_width / 2) - (label.get_width() / 2), tetris.grid_top_left_y + (tetris.game_height / 2) - (label.get_height() / 2)))
+		pygame.display.update()
+
+		# Whatever the text covered is restored on the next frame
+		self.full_redraw = True
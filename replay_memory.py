@@ -0,0 +1,279 @@
+""" Fixed-capacity ring-buffer replay memories storing boards as packed bits, in RAM or memory-mapped on disk, with optional prioritized sampling """
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+
+ARRAY_NAMES = ('states', 'actions', 'rewards', 'states_prime', 'terminals')
+
+class ReplayMemory:
+    def __init__(self, capacity: int = 10000, state_size: int = 200, packed: bool = True, seed: Optional[int] = None):
+        self.capacity = capacity
+        self.state_size = state_size
+
+        # Binary boards pack 8 cells per byte (200 cells -> 25 bytes), other state encodings are kept as float32
+        self.packed = packed
+        state_shape = (capacity, (state_size + 7) // 8) if packed else (capacity, state_size)
+        state_dtype = np.uint8 if packed else np.float32
+
+        self.states = self.allocate('states', state_shape, state_dtype)
+        self.actions = self.allocate('actions', (capacity,), np.int64)
+        self.rewards = self.allocate('rewards', (capacity,), np.float32)
+        self.states_prime = self.allocate('states_prime', state_shape, state_dtype)
+        self.terminals = self.allocate('terminals', (capacity,), bool)
+
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+        self.size = 0
+        self.experience = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def allocate(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        return np.zeros(shape=shape, dtype=dtype)
+
+    def latest_indices(self, count: Optional[int] = None) -> np.ndarray:
+        # Indices of the most recent `count` transitions (all of them by default), oldest first
+        count = self.size if count is None else min(count, self.size)
+        return (self.position - count + np.arange(count)) % self.capacity
+
+    def encode(self, state_spaces: np.ndarray) -> np.ndarray:
+        state_spaces = np.asarray(state_spaces).reshape(-1, self.state_size)
+        if self.packed:
+            return np.packbits(state_spaces.astype(np.uint8), axis=1)
+        return state_spaces.astype(np.float32)
+
+    def decode(self, stored: np.ndarray) -> np.ndarray:
+        if self.packed:
+            return np.unpackbits(stored, axis=1, count=self.state_size).astype(np.float32)
+        return stored
+
+    def add(self, state_space: np.ndarray, action: int, reward: float, state_space_prime: np.ndarray, terminal_state: bool):
+        # O(1) insert, overwriting the oldest transition once the memory is full
+        index = self.position
+        self.states[index] = self.encode(state_space)[0]
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.states_prime[index] = self.encode(state_space_prime)[0]
+        self.terminals[index] = terminal_state
+
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.experience += 1
+
+    def add_batch(self, state_spaces: np.ndarray, actions: np.ndarray, rewards: np.ndarray, state_spaces_prime: np.ndarray, terminal_states: np.ndarray, encoded: bool = False):
+        # encoded=True accepts boards that were already packed by encode(), e.g. by actor processes
+        count = len(actions)
+        indices = (self.position + np.arange(count)) % self.capacity
+        self.states[indices] = state_spaces if encoded else self.encode(state_spaces)
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.states_prime[indices] = state_spaces_prime if encoded else self.encode(state_spaces_prime)
+        self.terminals[indices] = terminal_states
+
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.experience += count
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        # Uniform over the whole filled region, not just the oldest entries
+        return self.rng.integers(low=0, high=self.size, size=min(batch_size, self.size))
+
+    def get(self, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return (self.decode(self.states[indices]), self.actions[indices], self.rewards[indices],
+                self.decode(self.states_prime[indices]), self.terminals[indices])
+
+    def sample(self, batch_size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return self.get(self.sample_indices(batch_size))
+
+    def flush(self):
+        # Nothing to write out for a memory held in RAM
+        pass
+
+    def nbytes(self) -> int:
+        return self.states.nbytes + self.actions.nbytes + self.rewards.nbytes + self.states_prime.nbytes + self.terminals.nbytes
+
+    def state_counters(self) -> dict:
+        return {'capacity': self.capacity, 'state_size': self.state_size, 'position': self.position, 'size': self.size, 'experience': self.experience,
+                'rng': self.rng.bit_generator.state}
+
+    def state_dict(self) -> dict:
+        # Everything needed to restore the memory exactly, the filled region is copied so inserts can continue while it is written out
+        return dict(self.state_counters(), arrays={name: getattr(self, name)[:self.size].copy() for name in ARRAY_NAMES})
+
+    def load_state_dict(self, state: dict):
+        assert(state['capacity'] == self.capacity and state['state_size'] == self.state_size), "replay snapshot has a different shape"
+        if state['arrays'] is not None:
+            for name, values in state['arrays'].items():
+                getattr(self, name)[:len(values)] = values
+        self.position, self.size, self.experience = state['position'], state['size'], state['experience']
+        self.rng.bit_generator.state = state['rng']
+
+
+class SumTree:
+    # Binary tree over `capacity` leaf priorities where every node holds the sum of its children, stored in a flat array with the root at index 1
+    def __init__(self, capacity: int):
+        # Rounded up to a power of two so every leaf sits at the same depth and batches descend in lockstep
+        self.leaves = 1 << max(0, int(capacity - 1).bit_length())
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self) -> float:
+        return self.tree[1]
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[self.leaves + np.asarray(indices)]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray):
+        # O(log n) per leaf, one vectorized pass per tree level for the whole batch
+        # Siblings share a parent, duplicate parents are simply written twice with the same sum
+        nodes = self.leaves + np.asarray(indices, dtype=np.int64)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes //= 2
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def set(self, index: int, priority: float):
+        # Scalar version of update() for single inserts, where per-level array overhead would dominate
+        tree = self.tree
+        node = self.leaves + index
+        tree[node] = priority
+        node //= 2
+        while node >= 1:
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+            node //= 2
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        # Leaf index whose prefix-sum interval contains each value, O(log n) per value
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values > self.tree[left]
+            values -= self.tree[left] * go_right
+            nodes = left + go_right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    # Samples transitions in proportion to priority ** alpha, typically the last TD error, so rare line clears are replayed more often
+    def __init__(self, capacity: int = 10000, state_size: int = 200, packed: bool = True, seed: Optional[int] = None,
+                 alpha: float = 0.6, beta: float = 0.4, beta_increment: float = 1e-4, priority_epsilon: float = 1e-3):
+        super().__init__(capacity=capacity, state_size=state_size, packed=packed, seed=seed)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        # Importance-sampling exponent, annealed towards 1 by `beta_increment` per sampled batch
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.priority_epsilon = priority_epsilon
+        # New transitions get the largest priority seen so far, so each is replayed at least once soon after insertion
+        self.max_priority = 1.0
+
+    def add(self, state_space: np.ndarray, action: int, reward: float, state_space_prime: np.ndarray, terminal_state: bool):
+        index = self.position
+        super().add(state_space, action, reward, state_space_prime, terminal_state)
+        self.tree.set(index, self.max_priority ** self.alpha)
+
+    def add_batch(self, state_spaces: np.ndarray, actions: np.ndarray, rewards: np.ndarray, state_spaces_prime: np.ndarray, terminal_states: np.ndarray, encoded: bool = False):
+        # Only the last `capacity` indices matter when a batch wraps around the ring
+        indices = (self.position + np.arange(max(0, len(actions) - self.capacity), len(actions))) % self.capacity
+        super().add_batch(state_spaces, actions, rewards, state_spaces_prime, terminal_states, encoded=encoded)
+        self.tree.update(indices, np.full(len(indices), self.max_priority ** self.alpha))
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        # Stratified: one draw from each of `batch_size` equal slices of the total priority mass
+        batch_size = min(batch_size, self.size)
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def importance_weights(self, indices: np.ndarray) -> np.ndarray:
+        # (N * P(i)) ** -beta, normalised by the largest weight in the batch so updates are only ever scaled down
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        priorities = np.abs(td_errors) + self.priority_epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def state_dict(self) -> dict:
+        return dict(super().state_dict(), tree=self.tree.tree.copy(), max_priority=self.max_priority, beta=self.beta)
+
+    def load_state_dict(self, state: dict):
+        super().load_state_dict(state)
+        self.tree.tree[:] = state['tree']
+        self.max_priority, self.beta = state['max_priority'], state['beta']
+
+
+class DiskReplayMemory(ReplayMemory):
+    # Bit-packed transitions in memory-mapped .npy files that survive restarts, reopening a directory resumes it
+    def __init__(self, directory: str, capacity: Optional[int] = None, state_size: int = 200, flush_every: int = 10000, seed: Optional[int] = None,
+                 create: bool = True):
+        self.directory = directory
+        # An existing directory keeps the capacity it was created with, `create=False` only opens one that already holds a memory
+        meta = self.read_meta()
+        if meta is None and not create:
+            raise FileNotFoundError('No replay memory in {} (missing {})'.format(directory, self.meta_path()))
+        os.makedirs(directory, exist_ok=True)
+        if meta is not None:
+            capacity = capacity or meta['capacity']
+            assert(meta['capacity'] == capacity and meta['state_size'] == state_size), "replay directory was created with a different shape"
+        capacity = capacity or 1000000
+
+        super().__init__(capacity=capacity, state_size=state_size, packed=True, seed=seed)
+
+        # Metadata (and the mapped pages) are written out once per chunk of `flush_every` inserts rather than per insert
+        self.flush_every = flush_every
+        self.unflushed = 0
+        if meta is not None:
+            self.position, self.size, self.experience = meta['position'], meta['size'], meta['experience']
+
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, 'meta.json')
+
+    def read_meta(self) -> Optional[dict]:
+        if not os.path.exists(self.meta_path()):
+            return None
+        with open(self.meta_path(), 'r') as file:
+            return json.load(file)
+
+    def allocate(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        path = os.path.join(self.directory, name + '.npy')
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r+')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def add(self, state_space: np.ndarray, action: int, reward: float, state_space_prime: np.ndarray, terminal_state: bool):
+        super().add(state_space, action, reward, state_space_prime, terminal_state)
+        self.count_inserts(1)
+
+    def add_batch(self, state_spaces: np.ndarray, actions: np.ndarray, rewards: np.ndarray, state_spaces_prime: np.ndarray, terminal_states: np.ndarray, encoded: bool = False):
+        super().add_batch(state_spaces, actions, rewards, state_spaces_prime, terminal_states, encoded=encoded)
+        self.count_inserts(len(actions))
+
+    def count_inserts(self, count: int):
+        self.unflushed += count
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def state_dict(self) -> dict:
+        # The transitions already live on disk, a snapshot only needs them flushed and the counters recorded
+        self.flush()
+        return dict(self.state_counters(), arrays=None)
+
+    def flush(self):
+        for name in ARRAY_NAMES:
+            getattr(self, name).flush()
+
+        # Written to a temporary file and swapped in so a crash never leaves half-written metadata behind
+        meta = {'capacity': self.capacity, 'state_size': self.state_size, 'position': self.position, 'size': self.size, 'experience': self.experience}
+        with open(self.meta_path() + '.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(self.meta_path() + '.tmp', self.meta_path())
+        self.unflushed = 0
@@ -1,129 +1,374 @@
 """ File containing functionality to run the Tetris game """
-import pygame
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from typing import Optional
 
 import numpy as np
+import pygame
 
 from tetris import Tetris
-from agent import TetrisAgent
+from locked_positions import LockedPositions
+from renderer import TetrisRenderer
+from tetris_env import TetrisEnv
+from state_encoder import StateEncoder
+from episode_log import write_episodes
+from vector_env import VectorTetris
+from actor_learner import run_actor_learner
+from metrics import TrainingMetrics
+from stats_store import StatsStore
+from run_manager import RunManager
+from expert import generate_demonstrations, load_demonstrations, pretrain
+from training_loop import episode_seed, finish_episode, learn, run_move_episode, run_placement_episode, split_config
 
 EPISODES = 25
 
+# Train without a window or frame clock, stepping the game at CPU speed
+HEADLESS = False
 
-if __name__ == '__main__':	
-	episode = 0
-	while episode < EPISODES:
-		tetris = Tetris()
-		player = TetrisAgent()
-		player.summary()
+# Number of headless boards stepped in lockstep per episode, 1 plays a single TetrisEnv game
+NUM_ENVS = 1
 
-		window = pygame.display.set_mode((tetris.window_width, tetris.window_height))
-		pygame.display.set_caption('Tetris')
-		
-		locked_positions = {}
-		tetris.create_grid(locked_positions)
-		
-		change_piece = False 
-		run = True
-		current_piece = tetris.get_shape()
-		next_piece = tetris.get_shape()
-		clock = pygame.time.Clock()
-		fall_time = 0
-		fall_speed = 0.35
-		level_time = 0
-		score = 0
-		high_score = tetris.get_max_score()
-
-		while run:
-			# Create new grid with updated locked positions
-			grid = tetris.create_grid(locked_positions)
-			state_space = player.process_state_space(piece_position=tetris.convert_shape_format(current_piece), grid=grid)
-
-			fall_time += clock.get_rawtime()
-			level_time += clock.get_rawtime()
-
-			clock.tick()
-
-			# Increase difficulty every 10 seconds
-			if level_time / 1000 > 5:
-				level_time = 0
-				# Until fall speed exceeds 0.15
-				if fall_speed > 0.15:
-					fall_speed -= 0.005
+# Number of headless actor processes feeding one learner, 0 keeps the single-process episode loop
+ACTORS = 0
+ACTOR_TRANSITIONS = 200000
+
+# 'move' acts once per frame with a micro-move, 'placement' picks the final drop of each piece in one decision
+ACTION_MODE = 'move'
+
+# 'board' feeds the 200 occupancy cells to the network, 'features' feeds column heights, holes and bumpiness
+STATE_MODE = 'board'
+
+# Placement mode looks ahead over the current and previewed next piece when PLAN_DEPTH is 2 (1 plans the current piece only, 0 picks greedily)
+PLAN_DEPTH = 0
+BEAM_WIDTH = 8
+PLAN_TIME_BUDGET = 0.05
+
+# Draw only every N-th frame of a windowed episode so watching training does not throttle it
+RENDER_EVERY = 1
+
+# A flat config, e.g. of the best sweep.py trial: keys named after constants in this file (action_mode, target_update, double_dqn,
+# train_every, mini_batch_size, seed, ...) override them, the other TetrisAgent arguments (alpha, gamma, epsilon, rewards, memory) go to the agent
+AGENT_CONFIG = {}
+
+# Seed and piece generator ('uniform' or 'bag') of headless games, and where to append their compact episode logs (vector games, NUM_ENVS > 1,
+# take the seed but only deal uniformly and are not recorded)
+SEED = None
+GENERATOR = 'uniform'
+RECORD_PATH = None
+
+# Weights-only export written next to the Keras model, loaded by inference.InferenceAgent without TensorFlow
+EXPORT_PATH = './dql_tetris.npz'
+
+# Directory of a memory-mapped replay memory that persists across episodes and runs, None keeps it in RAM
+REPLAY_DIR = None
+
+# Sample replay in proportion to TD error from a sum-tree of PRIORITIZED_CAPACITY transitions instead of uniformly (in RAM only)
+PRIORITIZED_REPLAY = False
+PRIORITIZED_CAPACITY = 1000000
 
+# Directory of full-state snapshots (weights, Adam state, replay, RNGs, counters) taken every CHECKPOINT_EVERY episodes, the last
+# KEEP_CHECKPOINTS are kept and a run restarted with the same directory resumes from the latest one, None disables snapshots
+RUN_DIR = None
+CHECKPOINT_EVERY = 5
+KEEP_CHECKPOINTS = 3
+
+# Before RL starts, seed the replay memory with PRETRAIN_GAMES heuristic expert games (or the demonstrations saved at
+# DEMONSTRATIONS_PATH) and fit the network on them for PRETRAIN_STEPS train() calls, board states only
+PRETRAIN_GAMES = 0
+PRETRAIN_STEPS = 0
+DEMONSTRATIONS_PATH = None
+
+# SQLite file collecting the score, lines, pieces and duration of every episode, shared safely by concurrent runs
+STATS_PATH = './stats.db'
+
+# Structured throughput log (.jsonl or .csv), steps between rows, and steps covered by a cProfile session (0 disables it)
+METRICS_PATH = None
+METRICS_EVERY = 1000
+PROFILE_STEPS = 0
+
+# Learn with a small-minibatch train_step every TRAIN_EVERY steps once LEARNING_STARTS transitions are stored, 0 keeps one large fit per episode
+TRAIN_EVERY = 0
+MINI_BATCH_SIZE = 32
+LEARNING_STARTS = 1000
+
+# Step cap per headless or placement episode, None plays every game to the end
+MAX_STEPS = None
+
+# Frozen target network synced every TARGET_UPDATE train steps, or Polyak-averaged with POLYAK_TAU when non-zero, 0 for both bootstraps from the online network
+TARGET_UPDATE = 0
+POLYAK_TAU = 0.0
+DOUBLE_DQN = False
+
+
+def play_windowed_episode(player: TetrisAgent, metrics: TrainingMetrics, stats: StatsStore, options: dict):
+	tetris = Tetris()
+
+	window = pygame.display.set_mode((tetris.window_width, tetris.window_height))
+	pygame.display.set_caption('Tetris')
+	renderer = TetrisRenderer(tetris, window, render_every=RENDER_EVERY)
+	
+	locked_positions = LockedPositions(rows=tetris.rows, columns=tetris.columns)
+	tetris.create_grid(locked_positions)
+	encoder = StateEncoder(rows=tetris.rows, columns=tetris.columns, mode=STATE_MODE)
+	
+	change_piece = False 
+	run = True
+	current_piece = tetris.get_shape()
+	next_piece = tetris.get_shape()
+	clock = pygame.time.Clock()
+	fall_time = 0
+	fall_speed = 0.35
+	level_time = 0
+	score = 0
+	lines = 0
+	pieces = 0
+	start = time.perf_counter()
+	high_score = stats.best_score()
+
+	while run:
+		# Create new grid with updated locked positions
+		grid = tetris.create_grid(locked_positions)
+		with metrics.phase('encode'):
+			state_space = encoder.encode(tetris.convert_shape_format(current_piece))
+
+		fall_time += clock.get_rawtime()
+		level_time += clock.get_rawtime()
+
+		clock.tick()
+
+		# Increase difficulty every 10 seconds
+		if level_time / 1000 > 5:
+			level_time = 0
+			# Until fall speed exceeds 0.15
+			if fall_speed > 0.15:
+				fall_speed -= 0.005
+
+		with metrics.phase('inference'):
 			action = player.epsilon_greedy_selection(state_space=state_space.reshape(1, -1))
-			if action == 0:
-				current_piece.x -= 1
-				if not tetris.valid_space(current_piece, grid):
-					current_piece.x += 1
-			elif action == 1:
+		if action == 0:
+			current_piece.x -= 1
+			if not tetris.valid_space(current_piece, grid):
 				current_piece.x += 1
-				if not tetris.valid_space(current_piece, grid):
-					current_piece.x -= 1
-			elif action == 2:
-				current_piece.y += 1
-				if not tetris.valid_space(current_piece, grid):
-					current_piece.y -= 1
-			elif action == 3:
-				current_piece.rotation = current_piece.rotation + 1 % len(current_piece.shape)
-				if not tetris.valid_space(current_piece, grid):
-					current_piece.rotation = current_piece.rotation - 1 % len(current_piece.shape)
-
-			if fall_time / 1000 > fall_speed:
-				fall_time = 0
-				current_piece.y += 1
-				if not tetris.valid_space(current_piece, grid) and current_piece.y > 0:
-					current_piece.y -= 1
-					change_piece = True
-
-			for event in pygame.event.get():
-				if event.type == pygame.QUIT:
-					run = False 
-					pygame.display.quit()
-					quit()
-
-			piece_position = tetris.convert_shape_format(current_piece)
-
-			for i in range(len(piece_position)):
-				x, y = piece_position[i]
-				if y >= 0:
-					grid[y][x] = current_piece.colour 
-
-			if change_piece:
-				for position in piece_position:
-					p = (position[0], position[1])
-					locked_positions[p] = current_piece.colour
-
-				current_piece = next_piece
-				next_piece = tetris.get_shape()
-				change_piece = False
-				rows_cleared = tetris.clear_rows(grid, locked_positions)
-				score += rows_cleared * 10
-				tetris.update_score(score)
-
-				if high_score < score:
-					high_score = score
-			
-				reward = player.reward_function(rows_cleared=rows_cleared)
+		elif action == 1:
+			current_piece.x += 1
+			if not tetris.valid_space(current_piece, grid):
+				current_piece.x -= 1
+		elif action == 2:
+			current_piece.y += 1
+			if not tetris.valid_space(current_piece, grid):
+				current_piece.y -= 1
+		elif action == 3:
+			current_piece.rotation = current_piece.rotation + 1 % len(current_piece.shape)
+			if not tetris.valid_space(current_piece, grid):
+				current_piece.rotation = current_piece.rotation - 1 % len(current_piece.shape)
 
-			else:
-				reward = player.reward_function(rows_cleared=0)
+		if fall_time / 1000 > fall_speed:
+			fall_time = 0
+			current_piece.y += 1
+			if not tetris.valid_space(current_piece, grid) and current_piece.y > 0:
+				current_piece.y -= 1
+				change_piece = True
+
+		for event in pygame.event.get():
+			if event.type == pygame.QUIT:
+				run = False 
+				pygame.display.quit()
+				quit()
+
+		piece_position = tetris.convert_shape_format(current_piece)
+
+		for i in range(len(piece_position)):
+			x, y = piece_position[i]
+			if y >= 0:
+				grid[y][x] = current_piece.colour 
 
-			tetris.draw_window(window, grid, score, high_score)
-			tetris.draw_next_shape(next_piece, window)
-			pygame.display.update()
+		if change_piece:
+			for position in piece_position:
+				p = (position[0], position[1])
+				locked_positions[p] = current_piece.colour
 
-			if tetris.check_loss(locked_positions):
-				run = False
-				reward = player.reward_function(rows_cleared=0, terminal=True)
-				state_space_prime = state_space
+			current_piece = next_piece
+			next_piece = tetris.get_shape()
+			change_piece = False
+			rows_cleared = tetris.clear_rows(grid, locked_positions)
+			# The encoder's locked occupancy only changes here, cleared rows shift every cell so it is rebuilt
+			if rows_cleared > 0:
+				encoder.refresh(locked_positions)
 			else:
-				state_space_prime = player.process_state_space(piece_position=piece_position, grid=grid)
+				encoder.lock(piece_position)
+			score += rows_cleared * 10
+			lines += rows_cleared
+			pieces += 1
+
+			if high_score < score:
+				high_score = score
+		
+			reward = player.reward_function(rows_cleared=rows_cleared)
+
+		else:
+			reward = player.reward_function(rows_cleared=0)
+
+		with metrics.phase('render'):
+			renderer.render(grid, score, high_score, next_piece)
+
+		if tetris.check_loss(locked_positions):
+			run = False
+			reward = player.reward_function(rows_cleared=0, terminal=True)
+			state_space_prime = state_space
+		else:
+			with metrics.phase('encode'):
+				state_space_prime = encoder.encode(tetris.convert_shape_format(current_piece))
+		with metrics.phase('replay_insert'):
 			player.update_replay_buffer(state_space=state_space, action=action, reward=reward, state_space_prime=state_space_prime, terminal_state=not run)
+		metrics.step(transitions=1)
+		learn(player, metrics, options)
+
+	stats.record_episode(score=score, lines=lines, pieces=pieces, duration=time.perf_counter() - start, mode='windowed')
+	renderer.render(grid, score, high_score, next_piece, force=True)
+	renderer.draw_text_middle("Game Over", 40, (255, 255, 255))
+	pygame.time.delay(2000)
+	pygame.quit()
+
+
+def play_headless_episode(player: TetrisAgent, env: TetrisEnv, metrics: TrainingMetrics, stats: StatsStore, options: dict, seed: Optional[int] = None):
+	start = time.perf_counter()
+	result = run_move_episode(player, env, metrics, options, seed=seed, record=RECORD_PATH is not None)
+	stats.record_episode(score=result['score'], lines=result['lines'], pieces=result['pieces'], duration=time.perf_counter() - start, mode='headless')
+	if result['log'] is not None:
+		write_episodes(RECORD_PATH, [result['log']])
+	print('Episode finished with score {} after {} pieces'.format(result['score'], result['pieces']))
+
+
+def play_placement_episode(player: TetrisAgent, env: TetrisEnv, metrics: TrainingMetrics, stats: StatsStore, options: dict, seed: Optional[int] = None):
+	start = time.perf_counter()
+	result = run_placement_episode(player, env, metrics, options, seed=seed, record=RECORD_PATH is not None)
+	stats.record_episode(score=result['score'], lines=result['lines'], pieces=result['pieces'], duration=time.perf_counter() - start, mode='placement')
+	if result['log'] is not None:
+		write_episodes(RECORD_PATH, [result['log']])
+	print('Episode finished with score {} after {} pieces'.format(result['score'], result['pieces']))
+	if result['planner'] is not None:
+		print('Planner: ' + ', '.join('{} {}'.format(key, value) for key, value in result['planner'].items()))
+
+
+def play_vector_episode(player: TetrisAgent, num_envs: int, metrics: TrainingMetrics, stats: StatsStore, options: dict, seed: Optional[int] = None):
+	# VectorTetris only produces board observations, and draws every board's pieces uniformly from one stream seeded per episode.
+	# Its games cannot be replayed by TetrisEnv, so they are neither dealt from a bag nor recorded
+	assert(STATE_MODE == 'board')
+	assert(GENERATOR == 'uniform'), "vector episodes only support GENERATOR = 'uniform'"
+	assert(RECORD_PATH is None), 'vector episodes cannot be recorded, set RECORD_PATH = None or NUM_ENVS = 1'
+	env = VectorTetris(num_envs=num_envs, reward_function=player.batch_reward_function, seed=seed)
+	state_spaces = env.reset()
 
-		tetris.draw_text_middle("Game Over", 40, (255, 255, 255), window)
-		pygame.display.update()
-		pygame.time.delay(2000)
-		pygame.quit()
+	# Boards restart automatically, the episode ends once `num_envs` games have finished
+	games = 0
+	while games < num_envs:
+		with metrics.phase('inference'):
+			actions = player.batch_epsilon_greedy_selection(state_spaces=state_spaces)
+		with metrics.phase('env_step'):
+			state_spaces_prime, rewards, dones, info = env.step(actions)
+		with metrics.phase('replay_insert'):
+			player.update_replay_buffer_batch(state_spaces=state_spaces, actions=actions, rewards=rewards, state_spaces_prime=state_spaces_prime, terminal_states=dones)
+		state_spaces = state_spaces_prime
+		games += int(dones.sum())
+		# Boards finish at different times, so no per-game duration is recorded
+		for board in np.flatnonzero(dones):
+			stats.record_episode(score=info['score'][board], lines=info['lines'][board], pieces=info['pieces'][board], mode='vector')
+		metrics.step(steps=num_envs, transitions=num_envs)
+		learn(player, metrics, options, steps=num_envs)
 
-		player.train(mini_batch_size=1000, epochs=1)
+	print('Finished {} games across {} boards'.format(games, num_envs))
+
+
+def agent_version(player: TetrisAgent, options: dict) -> str:
+	# Names the configuration in the stats store, so percentiles of differently configured runs are not mixed. Runs that differ only
+	# by their seed share a version
+	config = dict(player.hyperparameters(), **{key: value for key, value in options.items() if key != 'seed'})
+	digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:10]
+	return '{}-{}-{}'.format(config['action_mode'], config['state_mode'], digest)
+
+
+if __name__ == '__main__':
+	# Spawned actor processes re-import this module, so TensorFlow (via agent) is only imported here, annotations above are never evaluated
+	from agent import TetrisAgent
+
+	# AGENT_CONFIG overrides the matching constants, so everything below (and the episode functions) sees the effective settings
+	agent_config, loop_config = split_config(AGENT_CONFIG)
+	ACTION_MODE = agent_config.pop('action_mode', ACTION_MODE)
+	STATE_MODE = agent_config.pop('state_mode', STATE_MODE)
+	TARGET_UPDATE = agent_config.pop('target_update', TARGET_UPDATE)
+	POLYAK_TAU = agent_config.pop('polyak_tau', POLYAK_TAU)
+	DOUBLE_DQN = agent_config.pop('double_dqn', DOUBLE_DQN)
+	options = dict({'train_every': TRAIN_EVERY, 'mini_batch_size': MINI_BATCH_SIZE, 'learning_starts': LEARNING_STARTS, 'plan_depth': PLAN_DEPTH,
+					'beam_width': BEAM_WIDTH, 'plan_time_budget': PLAN_TIME_BUDGET, 'max_steps': MAX_STEPS, 'seed': SEED}, **loop_config)
+
+	metrics = TrainingMetrics(path=METRICS_PATH, log_every=METRICS_EVERY, profile_steps=PROFILE_STEPS)
+
+	def make_agent() -> TetrisAgent:
+		agent = TetrisAgent(action_mode=ACTION_MODE, state_mode=STATE_MODE, target_update=TARGET_UPDATE, polyak_tau=POLYAK_TAU, double_dqn=DOUBLE_DQN, **agent_config)
+		if REPLAY_DIR is not None:
+			agent.use_disk_replay_memory(REPLAY_DIR)
+		elif PRIORITIZED_REPLAY:
+			agent.use_prioritized_replay_memory(capacity=PRIORITIZED_CAPACITY)
+		return agent
+
+	if ACTORS > 0:
+		player = run_actor_learner(num_actors=ACTORS, total_transitions=ACTOR_TRANSITIONS, options=options, player=make_agent(), generator=GENERATOR, metrics=metrics)
+		metrics.stop_profile()
+		player.flush_replay_memory()
+		player.save_model()
+		player.save_model(EXPORT_PATH)
+		quit()
+
+	# One agent learns across every episode, its network, optimizer and replay memory carry over
+	episode = 0
+	run = None
+	resumed = False
+	if RUN_DIR is not None:
+		run = RunManager(RUN_DIR, make_agent, keep=KEEP_CHECKPOINTS)
+		resumed = run.resume()
+		if resumed:
+			episode = run.episode
+			metrics.steps, metrics.transitions, metrics.episodes = run.counters['steps'], run.counters['transitions'], run.counters['episodes']
+		player = run.agent
+	else:
+		player = make_agent()
+	stats = StatsStore(STATS_PATH, agent_version=agent_version(player, options))
+
+	# A resumed run already holds the pretrained network and replay contents
+	if not resumed and (PRETRAIN_GAMES > 0 or DEMONSTRATIONS_PATH is not None):
+		assert(STATE_MODE == 'board')
+		if DEMONSTRATIONS_PATH is not None:
+			demonstrations = load_demonstrations(DEMONSTRATIONS_PATH)
+		else:
+			demonstrations = generate_demonstrations(PRETRAIN_GAMES, action_mode=ACTION_MODE, seed=options['seed'] or 0)
+		pretrain(player, demonstrations, train_steps=PRETRAIN_STEPS)
+	player.summary()
+
+	env = TetrisEnv(reward_function=player.reward_function, state_mode=STATE_MODE, generator=GENERATOR, metrics=metrics)
+	while episode < EPISODES:
+		if ACTION_MODE == 'placement':
+			play_placement_episode(player, env, metrics, stats, options, seed=episode_seed(options, episode))
+		elif HEADLESS and NUM_ENVS > 1:
+			play_vector_episode(player, NUM_ENVS, metrics, stats, options, seed=episode_seed(options, episode))
+		elif HEADLESS:
+			play_headless_episode(player, env, metrics, stats, options, seed=episode_seed(options, episode))
+		else:
+			play_windowed_episode(player, metrics, stats, options)
+
+		finish_episode(player, metrics, options)
 		episode += 1
+
+		if run is not None and episode % CHECKPOINT_EVERY == 0:
+			run.snapshot(episode, steps=metrics.steps, transitions=metrics.transitions, episodes=metrics.episodes)
+
+	metrics.stop_profile()
+	if run is not None:
+		run.close()
+	player.flush_replay_memory()
+	player.save_model()
+	player.save_model(EXPORT_PATH)
+	print('Best score {}, percentiles {}'.format(stats.best_score(refresh=True), stats.percentiles()))
+	stats.close()
@@ -0,0 +1,86 @@
+""" Resumable training runs: one long-lived agent with full-state snapshots written by a background thread """
+import glob
+import os
+import pickle
+import queue
+import random
+import threading
+import time
+from typing import Callable
+
+
+class RunManager:
+    def __init__(self, directory: str, make_agent: Callable[[], object], keep: int = 3):
+        # `make_agent` builds a fresh agent (including any replay memory swap), resume() then overwrites its state from the latest snapshot
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.agent = make_agent()
+        assert(keep >= 1)
+        self.keep = keep
+
+        self.episode = 0
+        self.counters = {}
+
+        # At most one snapshot waits behind the one being written, so a slow disk throttles snapshots rather than memory
+        self.pending = queue.Queue(maxsize=1)
+        self.writer_error = None
+        self.writer = threading.Thread(target=self.write_loop, name='snapshot-writer', daemon=True)
+        self.writer.start()
+
+    def checkpoint_paths(self) -> list[str]:
+        # Oldest first, only fully written snapshots since partial ones keep their .tmp suffix
+        return sorted(glob.glob(os.path.join(self.directory, 'checkpoint-*.pkl')))
+
+    def resume(self) -> bool:
+        paths = self.checkpoint_paths()
+        if not paths:
+            return False
+        with open(paths[-1], 'rb') as file:
+            snapshot = pickle.load(file)
+
+        self.agent.set_training_state(snapshot['agent'])
+        random.setstate(snapshot['random'])
+        self.episode = snapshot['episode']
+        self.counters = snapshot['counters']
+        print('Resumed {} at episode {}'.format(paths[-1], self.episode))
+        return True
+
+    def snapshot(self, episode: int, **counters) -> float:
+        # Capture on the calling thread (the agent copies its arrays), serialise and write on the writer thread
+        # Returns the seconds training was paused for the capture
+        if self.writer_error is not None:
+            raise self.writer_error
+        self.episode = episode
+        self.counters = counters
+        start = time.perf_counter()
+        snapshot = {'episode': episode, 'counters': counters, 'random': random.getstate(), 'agent': self.agent.get_training_state()}
+        self.pending.put(snapshot)
+        return time.perf_counter() - start
+
+    def write_loop(self):
+        while True:
+            snapshot = self.pending.get()
+            try:
+                self.write(snapshot)
+            except Exception as error:
+                self.writer_error = error
+            finally:
+                self.pending.task_done()
+
+    def write(self, snapshot: dict):
+        path = os.path.join(self.directory, 'checkpoint-{:08d}.pkl'.format(snapshot['episode']))
+        # Written under a temporary name and renamed, so a crash mid-write never leaves a snapshot resume() would pick up
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+
+        for old in self.checkpoint_paths()[:-self.keep]:
+            os.remove(old)
+
+    def close(self):
+        # Wait for queued snapshots to reach the disk
+        self.pending.join()
+        if self.writer_error is not None:
+            raise self.writer_error
@@ -0,0 +1,83 @@
+""" Incremental state-space encoder keeping a persistent locked-cell occupancy array between frames """
+import numpy as np
+
+
+# Column heights, aggregate height, holes, bumpiness, and the (x, y) of the four falling piece cells
+FEATURE_SIZE = 10 + 3 + 8
+STATE_SIZES = {'board': 200, 'features': FEATURE_SIZE}
+
+
+def board_features(boards: np.ndarray) -> np.ndarray:
+    # Engineered features of a batch of (K, rows, columns) occupancy boards
+    occupied = np.asarray(boards) > 0
+    filled_from_top = np.maximum.accumulate(occupied, axis=1)
+
+    heights = filled_from_top.sum(axis=1)
+    holes = (filled_from_top & ~occupied).sum(axis=(1, 2))
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    return np.column_stack((heights, heights.sum(axis=1), holes, bumpiness)).astype(np.float64)
+
+
+class StateEncoder:
+    def __init__(self, rows: int = 20, columns: int = 10, mode: str = 'board'):
+        assert(mode in STATE_SIZES)
+        self.rows = rows
+        self.columns = columns
+        self.mode = mode
+        self.state_size = STATE_SIZES[mode] if mode == 'features' else rows * columns
+
+        # Only rewritten when locked positions change (lock-in or cleared rows), never per frame
+        self.locked = np.zeros(shape=(rows, columns))
+        self.locked_features = np.zeros(shape=FEATURE_SIZE - 8)
+
+    def reset(self):
+        self.locked[:] = 0
+        self.update_features()
+
+    def update_features(self):
+        if self.mode == 'features':
+            self.locked_features = board_features(self.locked[None])[0]
+
+    def lock(self, positions: list[tuple]):
+        # Add freshly locked cells, enough on its own when no rows were cleared
+        for x, y in positions:
+            if 0 <= y < self.rows and 0 <= x < self.columns:
+                self.locked[y][x] = 1
+        self.update_features()
+
+    def refresh(self, locked_positions: dict):
+        # Rebuild from a Tetris locked_positions dict, needed after clear_rows shifts cells down
+        self.locked[:] = 0
+        self.lock(list(locked_positions))
+
+    def set_locked(self, occupancy: np.ndarray):
+        # Rebuild from a (rows, columns) occupancy array such as BitBoard.occupancy()
+        self.locked[:] = occupancy
+        self.update_features()
+
+    def encode(self, piece_position: list[tuple]) -> np.ndarray:
+        if self.mode == 'features':
+            cells = np.zeros(shape=8)
+            for i, (x, y) in enumerate(piece_position[:4]):
+                cells[2 * i], cells[2 * i + 1] = x / self.columns, y / self.rows
+            return np.concatenate((self.locked_features, cells))
+
+        state_space = self.locked.copy()
+        for x, y in piece_position:
+            if 0 <= y < self.rows and 0 <= x < self.columns:
+                state_space[y][x] = 1
+        return state_space.flatten()
+
+    def encode_boards(self, boards: np.ndarray) -> np.ndarray:
+        # Encode a batch of flattened boards without a falling piece, e.g. placement afterstates
+        if self.mode == 'features':
+            features = board_features(np.asarray(boards).reshape(-1, self.rows, self.columns))
+            return np.hstack((features, np.zeros(shape=(len(features), 8))))
+        return np.asarray(boards, dtype=np.float64).reshape(-1, self.state_size)
+
+    def encode_row_masks(self, row_masks: list[list[int]]) -> np.ndarray:
+        # Encode a batch of bitboards (one integer mask per row, e.g. BitBoard.board), expanding every mask to cells in one vectorized pass
+        if not row_masks:
+            return np.zeros(shape=(0, self.state_size))
+        cells = np.array(row_masks, dtype=np.int64)[:, :, None] >> np.arange(self.columns)
+        return self.encode_boards((cells & 1).reshape(len(row_masks), -1))
@@ -0,0 +1,143 @@
+""" Buffered per-episode statistics and high scores, written in batches to SQLite by a background thread """
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+
+FIELDS = ('time', 'score', 'lines', 'pieces', 'duration', 'agent_version', 'mode')
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL, score INTEGER, lines INTEGER, pieces INTEGER, duration REAL, agent_version TEXT, mode TEXT)'''
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # WAL lets many game processes append while others read, writers wait on each other's transactions instead of failing
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(SCHEMA)
+    connection.execute('CREATE INDEX IF NOT EXISTS episodes_score ON episodes (score)')
+    connection.commit()
+    return connection
+
+
+class StatsStore:
+    def __init__(self, path: str = './stats.db', flush_interval: float = 2.0, batch_size: int = 256, agent_version: Optional[str] = None,
+                 highscore_path: Optional[str] = './highscore.txt'):
+        self.path = path
+        self.agent_version = agent_version
+        # The legacy high score file is read once here and written once by close(), never per piece
+        self.highscore_path = highscore_path
+
+        # Rows wait in memory and are written as one transaction per batch or per `flush_interval` seconds, whichever comes first
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = queue.Queue()
+        self.writer_error = None
+        self.closed = False
+
+        connection = connect(path)
+        self.best = connection.execute('SELECT MAX(score) FROM episodes').fetchone()[0] or 0
+        connection.close()
+        self.best = max(self.best, self.read_highscore())
+
+        self.writer = threading.Thread(target=self.write_loop, name='stats-writer', daemon=True)
+        self.writer.start()
+        self.reader = None
+        # The writer is a daemon thread, whatever is still queued at interpreter exit is committed here (a no-op after an explicit close)
+        atexit.register(self.close)
+
+    def read_highscore(self) -> int:
+        try:
+            with open(self.highscore_path, 'r') as file:
+                return int(file.readline().strip() or 0)
+        except (TypeError, OSError, ValueError):
+            return 0
+
+    def record_episode(self, score: int, lines: int = 0, pieces: int = 0, duration: Optional[float] = None, mode: Optional[str] = None,
+                       agent_version: Optional[str] = None):
+        # Only touches memory, the writer thread does the I/O
+        self.best = max(self.best, int(score))
+        self.pending.put((time.time(), int(score), int(lines), int(pieces), duration, agent_version or self.agent_version, mode))
+
+    def best_score(self, refresh: bool = False) -> int:
+        # Best of this process (including unflushed episodes) and of everything on disk when the store was opened,
+        # refresh=True also picks up what other processes have committed since
+        if refresh:
+            self.best = max(self.best, self.query('SELECT MAX(score) FROM episodes')[0][0] or 0)
+        return self.best
+
+    def write_loop(self):
+        connection = connect(self.path)
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            # None marks a flush request, it is acknowledged once everything queued before it is committed
+            rows = [row for row in batch if row is not None]
+            try:
+                if rows:
+                    with connection:
+                        connection.executemany('INSERT INTO episodes ({}) VALUES ({})'.format(', '.join(FIELDS), ', '.join('?' * len(FIELDS))), rows)
+            except sqlite3.Error as error:
+                self.writer_error = error
+            for _ in batch:
+                self.pending.task_done()
+
+    def flush(self):
+        # Block until every episode recorded so far is committed
+        self.pending.put(None)
+        self.pending.join()
+        if self.writer_error is not None:
+            raise self.writer_error
+
+    def query(self, sql: str, parameters: tuple = ()) -> list:
+        self.flush()
+        if self.reader is None:
+            self.reader = connect(self.path)
+        return self.reader.execute(sql, parameters).fetchall()
+
+    def scores(self, agent_version: Optional[str] = None, mode: Optional[str] = None) -> np.ndarray:
+        # Scores of every episode on disk from all processes, optionally filtered
+        conditions = [(column, value) for column, value in (('agent_version', agent_version), ('mode', mode)) if value is not None]
+        where = ' WHERE ' + ' AND '.join('{} = ?'.format(column) for column, _ in conditions) if conditions else ''
+        return np.array([score for score, in self.query('SELECT score FROM episodes' + where, tuple(value for _, value in conditions))], dtype=np.int64)
+
+    def best_scores(self, count: int = 10, agent_version: Optional[str] = None) -> list[dict]:
+        where, parameters = (' WHERE agent_version = ?', (agent_version,)) if agent_version is not None else ('', ())
+        rows = self.query('SELECT {} FROM episodes{} ORDER BY score DESC LIMIT ?'.format(', '.join(FIELDS), where), parameters + (count,))
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+    def percentiles(self, percentiles: tuple = (50, 90, 99), agent_version: Optional[str] = None, mode: Optional[str] = None) -> dict:
+        scores = self.scores(agent_version=agent_version, mode=mode)
+        if len(scores) == 0:
+            return {}
+        return {'p{}'.format(p): float(value) for p, value in zip(percentiles, np.percentile(scores, percentiles))}
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        # Keep highscore.txt meaningful for Tetris.get_max_score, re-reading it so a higher score from another process is not overwritten
+        # Written to a per-process temporary file and swapped in, so a concurrent reader never sees it empty or half-written
+        if self.highscore_path is not None and self.best > self.read_highscore():
+            temporary_path = '{}.{}.tmp'.format(self.highscore_path, os.getpid())
+            with open(temporary_path, 'w') as file:
+                file.write(str(self.best))
+            os.replace(temporary_path, self.highscore_path)
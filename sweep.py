@@ -0,0 +1,182 @@
+""" Parallel hyperparameter sweeps with successive-halving early stopping, one CPU-pinned trainer per worker process """
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+from typing import Optional
+
+import numpy as np
+
+from training_loop import TRAINING_DEFAULTS, episode_seed, finish_episode, run_move_episode, run_placement_episode, split_config
+
+
+# Loop options of a trial unless its config sets them, per-step learning and a step cap keep early rungs cheap
+SWEEP_DEFAULTS = dict(TRAINING_DEFAULTS, train_every=4, max_steps=20000, seed=0)
+
+DEFAULT_SPACE = {
+    'alpha': [1e-4, 3e-4, 1e-3, 2.5e-3],
+    'gamma': [0.8, 0.9, 0.95, 0.99],
+    'epsilon': [0.01, 0.04, 0.1],
+    'memory': [10000, 100000],
+    'target_update': [0, 500, 2000],
+    'double_dqn': [False, True],
+    'train_every': [1, 4, 16],
+    'mini_batch_size': [32, 128],
+}
+
+# Threads each worker may use, set by init_worker before TensorFlow is imported
+WORKER_THREADS = 1
+
+
+def grid_configs(space: dict) -> list[dict]:
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def sample_configs(space: dict, count: int, seed: int = 0) -> list[dict]:
+    # Random search over the grid without repeats, the whole grid when it has at most `count` points
+    configs = grid_configs(space)
+    if len(configs) <= count:
+        return configs
+    return random.Random(seed).sample(configs, count)
+
+
+def init_worker(next_cpu, threads: int):
+    # Pin each worker to its own block of `threads` CPUs and cap every math library at that many threads, so trials do not contend
+    global WORKER_THREADS
+    WORKER_THREADS = threads
+    with next_cpu.get_lock():
+        first = next_cpu.value
+        next_cpu.value += threads
+
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[variable] = str(threads)
+    # CPU affinity is only available on Linux, elsewhere the thread caps alone apply
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = os.cpu_count() or 1
+        os.sched_setaffinity(0, {(first + i) % cpus for i in range(threads)})
+
+
+def run_trial(trial: int, config: dict, episodes: int, directory: str) -> dict:
+    # Train a trial until its learning curve has `episodes` entries, resuming from its last snapshot when it was promoted
+    import tensorflow as tf
+    from agent import TetrisAgent
+    from metrics import TrainingMetrics
+    from run_manager import RunManager
+    from tetris_env import TetrisEnv
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(WORKER_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(WORKER_THREADS)
+    except RuntimeError:
+        # Already initialised by an earlier trial in this worker
+        pass
+
+    agent_config, loop_config = split_config(config)
+    options = dict(SWEEP_DEFAULTS, **loop_config)
+
+    start = time.perf_counter()
+    run = RunManager(os.path.join(directory, 'trial-{:04d}'.format(trial)), lambda: TetrisAgent(**agent_config), keep=1)
+    # Only counts steps (for the learning cadence), nothing is printed or written
+    metrics = TrainingMetrics(log_every=2 ** 62, verbose=False)
+    if run.resume():
+        metrics.steps = run.counters['steps']
+    else:
+        np.random.seed((options['seed'] or 0) * 100003 + trial)
+    curve = run.counters.get('curve', [])
+
+    # The same episode runner as rl_tetris, so the winning config trains there exactly as it did here
+    player = run.agent
+    env = TetrisEnv(reward_function=player.reward_function, state_mode=player.hyperparameters()['state_mode'], metrics=metrics)
+    run_episode = run_placement_episode if player.hyperparameters()['action_mode'] == 'placement' else run_move_episode
+    while len(curve) < episodes:
+        # Every trial is dealt the same games, so trials differ by their config and not by the pieces
+        result = run_episode(player, env, metrics, options, seed=episode_seed(options, len(curve)))
+        finish_episode(player, metrics, options)
+        curve.append({key: result[key] for key in ('score', 'lines', 'pieces', 'steps', 'capped')})
+
+    run.snapshot(len(curve), curve=curve, steps=metrics.steps)
+    run.close()
+    return {'trial': trial, 'curve': curve, 'seconds': time.perf_counter() - start}
+
+
+def objective(curve: list[dict], window: int = 5) -> tuple:
+    # Mean score over the last `window` episodes, ties (common early on, when nothing clears lines) broken by pieces survived
+    recent = curve[-window:]
+    return (float(np.mean([episode['score'] for episode in recent])), float(np.mean([episode['pieces'] for episode in recent])))
+
+
+def write_results(directory: str, trials: dict):
+    with open(os.path.join(directory, 'results.json.tmp'), 'w') as file:
+        json.dump(trials, file, indent=1)
+    os.replace(os.path.join(directory, 'results.json.tmp'), os.path.join(directory, 'results.json'))
+
+
+def successive_halving(configs: list[dict], directory: str = './sweep', min_episodes: int = 5, max_episodes: int = 135, eta: int = 3,
+                       processes: Optional[int] = None, threads: int = 1, window: int = 5) -> dict:
+    # Every trial runs for min_episodes, then only the best 1/eta continue for eta times as many episodes, until max_episodes
+    os.makedirs(directory, exist_ok=True)
+    processes = processes or max(1, (os.cpu_count() or 1) // threads)
+    # Reject unknown keys here rather than in every worker, and record the loop defaults in each config, so a config copied from
+    # results.json into rl_tetris.AGENT_CONFIG trains with the same loop settings as its trial
+    for config in configs:
+        split_config(config)
+    configs = [dict(SWEEP_DEFAULTS, **config) for config in configs]
+
+    trials = {trial: {'config': config, 'curve': [], 'status': 'running'} for trial, config in enumerate(configs)}
+    alive = list(trials)
+    budget = min(min_episodes, max_episodes)
+
+    # Spawned (not forked) workers so each one sets its thread limits before importing TensorFlow
+    context = mp.get_context('spawn')
+    next_cpu = context.Value('i', 0)
+    with context.Pool(processes, initializer=init_worker, initargs=(next_cpu, threads)) as pool:
+        while True:
+            for result in pool.starmap(run_trial, [(trial, trials[trial]['config'], budget, directory) for trial in alive], chunksize=1):
+                trials[result['trial']]['curve'] = result['curve']
+            write_results(directory, trials)
+
+            ranked = sorted(alive, key=lambda trial: objective(trials[trial]['curve'], window), reverse=True)
+            print('Rung of {} episodes: {} trials, best {} {}'.format(budget, len(alive), ranked[0], trials[ranked[0]]['config']))
+            if budget >= max_episodes or len(alive) <= 1:
+                break
+
+            alive = ranked[:max(1, len(alive) // eta)]
+            for trial in ranked[len(alive):]:
+                trials[trial]['status'] = 'stopped after {} episodes'.format(budget)
+            budget = min(budget * eta, max_episodes)
+
+    for trial in alive:
+        trials[trial]['status'] = 'finished'
+    write_results(directory, trials)
+    return trials
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--space', default=None, help='JSON file mapping config keys to lists of values, DEFAULT_SPACE otherwise')
+    parser.add_argument('--trials', type=int, default=81, help='configurations sampled from the space, 0 runs the whole grid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-episodes', type=int, default=5, help='episodes every trial gets before the first cut')
+    parser.add_argument('--max-episodes', type=int, default=135, help='episodes of the trials that survive every cut')
+    parser.add_argument('--eta', type=int, default=3, help='keep the best 1/eta of the trials at each rung')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, all cores divided by --threads by default')
+    parser.add_argument('--threads', type=int, default=1, help='CPU threads pinned to each worker')
+    parser.add_argument('--directory', default='./sweep', help='trial snapshots and results.json')
+    args = parser.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space is not None:
+        with open(args.space, 'r') as file:
+            space = json.load(file)
+    configs = grid_configs(space) if args.trials <= 0 else sample_configs(space, args.trials, seed=args.seed)
+    configs = [dict(config, seed=args.seed) for config in configs]
+
+    trials = successive_halving(configs, directory=args.directory, min_episodes=args.min_episodes, max_episodes=args.max_episodes,
+                                eta=args.eta, processes=args.processes, threads=args.threads)
+    finished = sorted((trial for trial in trials if trials[trial]['status'] == 'finished'), key=lambda trial: objective(trials[trial]['curve']), reverse=True)
+    for trial in finished:
+        print('trial {}: score {:.1f}, pieces {:.1f}, {}'.format(trial, *objective(trials[trial]['curve']), trials[trial]['config']))
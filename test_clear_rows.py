@@ -0,0 +1,136 @@
+""" Property tests for line clears: Tetris.clear_rows on plain dicts and LockedPositions against a row-list reference """
+import random
+
+import pytest
+
+from bitboard import BitBoard
+from locked_positions import LockedPositions
+from tetris import Tetris
+
+ROWS = 20
+COLUMNS = 10
+COLOUR = (255, 0, 0)
+
+
+def random_locked(rng: random.Random) -> dict:
+	# A stack with random, often non-contiguous full rows, partly filled rows and sometimes cells above the board
+	locked = {}
+	height = rng.randrange(1, ROWS + 1)
+	full_rows = set(rng.sample(range(ROWS - height, ROWS), rng.randrange(0, min(height, 5) + 1)))
+	for y in range(ROWS - height, ROWS):
+		for x in range(COLUMNS):
+			if y in full_rows or rng.random() < 0.6:
+				locked[(x, y)] = COLOUR
+	if rng.random() < 0.3:
+		for _ in range(rng.randrange(1, 5)):
+			locked[(rng.randrange(COLUMNS), rng.randrange(-2, 0))] = COLOUR
+	return locked
+
+
+def reference_clear_rows(locked: dict) -> tuple[int, dict]:
+	# Board rows as lists: drop the full ones and pad with empty rows on top, cells above the board fall by the number cleared
+	board = [[(x, y) in locked for x in range(COLUMNS)] for y in range(ROWS)]
+	remaining = [row for row in board if not all(row)]
+	cleared = ROWS - len(remaining)
+	board = [[False] * COLUMNS for _ in range(cleared)] + remaining
+
+	result = {(x, y): COLOUR for y, row in enumerate(board) for x, filled in enumerate(row) if filled}
+	result.update({(x, y + cleared): COLOUR for (x, y) in locked if y < 0})
+	return cleared, result
+
+
+def expected_counts(locked: dict) -> list[int]:
+	counts = [0] * ROWS
+	for _, y in locked:
+		if 0 <= y < ROWS:
+			counts[y] += 1
+	return counts
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_dict_clear_rows_matches_reference(seed):
+	rng = random.Random(seed)
+	tetris = Tetris()
+	for _ in range(100):
+		locked = random_locked(rng)
+		cleared, expected = reference_clear_rows(locked)
+		assert Tetris.clear_rows(tetris.create_grid(locked), locked) == cleared
+		assert locked == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_locked_positions_clear_rows_matches_reference(seed):
+	rng = random.Random(seed)
+	tetris = Tetris()
+	for _ in range(100):
+		cells = random_locked(rng)
+		locked = LockedPositions(ROWS, COLUMNS, cells)
+		cleared, expected = reference_clear_rows(cells)
+		assert Tetris.clear_rows(tetris.create_grid(locked), locked) == cleared
+		assert dict(locked) == expected
+		assert locked.row_counts == expected_counts(expected)
+		assert locked.top_cells == sum(y < 1 for _, y in expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_locked_positions_top_out_matches_bitboard(seed):
+	# BitBoard never stores cells above the board and treats locking one as a permanent game over
+	rng = random.Random(seed)
+	for _ in range(100):
+		cells = random_locked(rng)
+		locked = LockedPositions(ROWS, COLUMNS, cells)
+		board = BitBoard(columns=COLUMNS, rows=ROWS)
+		for x, y in cells:
+			if y < 0:
+				board.topped_out = True
+			else:
+				board.board[y] |= 1 << x
+
+		assert locked.clear_rows() == board.clear_rows()
+		assert locked.topped_out() == board.check_loss() == Tetris.check_loss(locked)
+		# Past a game over the dict keeps (and shifts) the cells BitBoard dropped, the boards only have to match before one
+		if not board.topped_out:
+			assert [sum(1 << x for x in range(COLUMNS) if (x, y) in locked) for y in range(ROWS)] == board.board
+
+
+def test_cell_above_board_keeps_game_over_and_is_counted():
+	locked = LockedPositions(ROWS, COLUMNS, {(x, y): COLOUR for y in (18, 19) for x in range(COLUMNS)})
+	locked[(3, -1)] = COLOUR
+	assert locked.clear_rows() == 2
+	assert dict(locked) == {(3, 1): COLOUR}
+	assert locked.row_counts[1] == 1
+	assert locked.topped_out()
+	assert locked.copy().topped_out()
+
+	locked.clear()
+	assert not locked.topped_out()
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_counters_follow_every_write(seed):
+	# Every mutating dict method, including setdefault, popitem and |=, has to keep the counters exact
+	rng = random.Random(seed)
+	locked = LockedPositions(ROWS, COLUMNS)
+	for _ in range(2000):
+		key = (rng.randrange(COLUMNS), rng.randrange(-1, ROWS))
+		operation = rng.random()
+		if operation < 0.4:
+			locked[key] = COLOUR
+		elif operation < 0.5:
+			locked.setdefault(key, COLOUR)
+		elif operation < 0.6:
+			locked.pop(key, None)
+		elif operation < 0.65 and locked:
+			locked.popitem()
+		elif operation < 0.75 and key in locked:
+			del locked[key]
+		elif operation < 0.8:
+			locked.update({(x, key[1]): COLOUR for x in range(COLUMNS)})
+		elif operation < 0.85:
+			locked |= {(x, key[1]): COLOUR for x in range(COLUMNS) if rng.random() < 0.8}
+		elif operation < 0.9:
+			locked.clear_rows()
+		assert isinstance(locked, LockedPositions)
+		assert locked.row_counts == expected_counts(locked)
+		assert locked.top_cells == sum(y < 1 for _, y in locked)
+		assert locked.full_rows() == [y for y, count in enumerate(expected_counts(locked)) if count == COLUMNS]
@@ -1,17 +1,29 @@
 """ Class file contianing necessary functionality for the Tetris board grid """
-import pygame
-import random
+from __future__ import annotations
 
+from bisect import bisect_right
+
+try:
+	import pygame
+except ImportError:
+	# Rendering is optional, the board logic is also used by the headless environment
+	pygame = None
+
+from locked_positions import LockedPositions
 from piece import Piece
+from piece_generator import make_generator
 
 
 class Tetris:
-	def __init__(self):
+	def __init__(self, seed: int = None, generator: str = 'uniform'):
 		self.columns = 10
 		self.rows = 20
 
 		self.shapes = ['S', 'Z', 'I', 'O', 'J', 'L', 'T']
 
+		# Per-game RNG so a seed reproduces the exact piece sequence, 'uniform' or 'bag' (7-bag)
+		self.generator = make_generator(generator, self.shapes, seed)
+
 		self.window_width = 800
 		self.window_height = 750
 
@@ -38,41 +50,23 @@ class Tetris:
 
 	@staticmethod
 	def convert_shape_format(piece: Piece) -> list[tuple]:
-		positions = []
-
-		# Fetch the corresponding piece format and desired rotation
-		shape_format = piece.shape[piece.rotation % len(piece.shape)]
-
-		# For each row of the shape format
-		for i, row in enumerate(shape_format):
-			# Split the string into list of characters
-			row = list(row)
-			for j, column in enumerate(row):
-				if column == '0':
-					positions.append((piece.x + j, piece.y + i))
-
-		# Required accomodation for offset in piece shape format definition
-		for i, pos in enumerate(positions):
-			positions[i] = (pos[0]-2, pos[1]-4)
-		return positions
+		# Translation of the offsets precompiled from the piece's shape format at import time
+		return piece.cells()
 
 	def valid_space(self, piece: Piece, grid: list[list[tuple]]) -> bool:
-		# Make a 2D list of all valid locations on the board that do not contain locked pieces 
-		accepted_positions = [[(x, y) for x in range(self.columns) if grid[y][x] == (0, 0, 0)] for y in range(self.rows)]
-
-		# Flatten and parse accepted positions and remove "sub-lists"
-		accepted_positions = [x for item in accepted_positions for x in item]
-
-		formatted_shape = self.convert_shape_format(piece)
-
-		for position in formatted_shape:
-			if position not in accepted_positions:
-				if position[1] >= 0:
-					return False
+		# Cells above the top of the board are always accepted, every other cell must be on the board and empty
+		for x, y in self.convert_shape_format(piece):
+			if y < 0:
+				continue
+			if y >= self.rows or not 0 <= x < self.columns or grid[y][x] != (0, 0, 0):
+				return False
 		return True
 
 	@staticmethod
 	def check_loss(positions: list[tuple]):
+		# A LockedPositions store tracks cells in the top row as they are written
+		if isinstance(positions, LockedPositions):
+			return positions.topped_out()
 		for position in positions:
 			_, y = position
 			if y < 1:
@@ -80,7 +74,7 @@ class Tetris:
 		return False
 
 	def get_shape(self):
-		return Piece(random.choice(self.shapes))
+		return Piece(self.generator.next())
 
 	def draw_text_middle(self, text: str, size: int, colour: str, surface: pygame.display):
 		font = pygame.font.Font('./arcade.TTF', size) # , bold=False, italic=True)
@@ -99,26 +93,23 @@ class Tetris:
 
 	@staticmethod
 	def clear_rows(grid: list[list[tuple]], locked: dict) -> int:
-		increment = 0
-		for i in range(len(grid)-1, -1, -1):
-			grid_row = grid[i]
-			if (0, 0, 0) not in grid_row:
-				increment += 1
-
-				index = i
-				for j in range(len(grid_row)):
-					try:
-						del locked[(j, i)]
-					except ValueError:
-						continue
-
-		if increment > 0:
-			for key in sorted(list(locked), key=lambda x: x[1])[::-1]:
-				x, y = key
-				if y < index:
-					new_key = (x, y + increment)
-					locked[new_key] = locked.pop(key)
-		return increment
+		# A LockedPositions store finds full rows from its counters, a plain dict from the grid
+		if isinstance(locked, LockedPositions):
+			return locked.clear_rows()
+
+		cleared = [i for i, grid_row in enumerate(grid) if (0, 0, 0) not in grid_row]
+		if not cleared:
+			return 0
+
+		# Every remaining cell drops by the number of cleared rows below it, which also handles non-contiguous clears
+		cleared_set = set(cleared)
+		shifted = {}
+		for (x, y), colour in locked.items():
+			if y not in cleared_set:
+				shifted[(x, y + len(cleared) - bisect_right(cleared, y))] = colour
+		locked.clear()
+		locked.update(shifted)
+		return len(cleared)
 
 	def draw_next_shape(self, piece: Piece, surface: pygame.display):
 		font = pygame.font.Font('./arcade.TTF', 30)
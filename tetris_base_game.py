@@ -1,7 +1,12 @@
 """ File containing functionality to run the Tetris game """
+import time
+
 import pygame
 
 from tetris import Tetris
+from locked_positions import LockedPositions
+from renderer import TetrisRenderer
+from stats_store import StatsStore
 
 
 if __name__ == '__main__':
@@ -9,8 +14,9 @@ if __name__ == '__main__':
 
 	window = pygame.display.set_mode((tetris.window_width, tetris.window_height))
 	pygame.display.set_caption('Tetris')
+	renderer = TetrisRenderer(tetris, window)
 	
-	locked_positions = {}
+	locked_positions = LockedPositions(rows=tetris.rows, columns=tetris.columns)
 	tetris.create_grid(locked_positions)
 	
 	change_piece = False 
@@ -22,7 +28,11 @@ if __name__ == '__main__':
 	fall_speed = 0.35
 	level_time = 0
 	score = 0
-	high_score = tetris.get_max_score()
+	lines = 0
+	pieces = 0
+	start = time.perf_counter()
+	stats = StatsStore()
+	high_score = stats.best_score()
 
 	while run:
 		# Create new grid with updated locked positions
@@ -94,20 +104,22 @@ if __name__ == '__main__':
 			current_piece = next_piece
 			next_piece = tetris.get_shape()
 			change_piece = False
-			score += tetris.clear_rows(grid, locked_positions) * 10
-			tetris.update_score(score)
+			rows_cleared = tetris.clear_rows(grid, locked_positions)
+			score += rows_cleared * 10
+			lines += rows_cleared
+			pieces += 1
 
 			if high_score < score:
 				high_score = score
 		
-		tetris.draw_window(window, grid, score, high_score)
-		tetris.draw_next_shape(next_piece, window)
-		pygame.display.update()
+		renderer.render(grid, score, high_score, next_piece)
 
 		if tetris.check_loss(locked_positions):
 			run = False
 
-	tetris.draw_text_middle("Game Over", 40, (255, 255, 255), window)
-	pygame.display.update()
+	stats.record_episode(score=score, lines=lines, pieces=pieces, duration=time.perf_counter() - start, mode='human')
+	stats.close()
+	renderer.render(grid, score, high_score, next_piece, force=True)
+	renderer.draw_text_middle("Game Over", 40, (255, 255, 255))
 	pygame.time.delay(2000)
 	pygame.quit()
@@ -0,0 +1,185 @@
+""" Headless Tetris environment exposing a reset() / step(action) interface with gravity counted in logical ticks """
+import random
+from typing import Callable, Optional
+
+import numpy as np
+
+from bitboard import BitBoard
+from state_encoder import StateEncoder
+from tetris import Tetris
+
+
+# Action indices shared with TetrisAgent: move left, move right, soft drop, rotate
+ACTIONS = (0, 1, 2, 3)
+
+
+class TetrisEnv:
+	def __init__(self, fall_ticks: int = 3, min_fall_ticks: int = 1, level_ticks: int = 500,
+				 reward_function: Optional[Callable[..., int]] = None, state_mode: str = 'board',
+				 seed: Optional[int] = None, generator: str = 'uniform', compute_observations: bool = True, metrics=None):
+		self.tetris = Tetris(generator=generator)
+
+		# Every episode is dealt from its own seed, drawn from this stream unless reset() is given one explicitly
+		self.seed_rng = random.Random(seed)
+		self.generator = generator
+		self.episode_seed = None
+
+		# Re-simulation only needs scores and statistics, so building observations can be switched off
+		self.compute_observations = compute_observations
+
+		# Optional TrainingMetrics, observation building is then timed as the 'encode' phase
+		self.metrics = metrics
+
+		# Locked cells live in a bitboard, the windowed game (and its renderer) keeps its own coloured locked_positions
+		self.board = BitBoard(columns=self.tetris.columns, rows=self.tetris.rows)
+
+		# Observations reuse the encoder's cached occupancy, which is only refreshed when a piece locks
+		self.encoder = StateEncoder(rows=self.tetris.rows, columns=self.tetris.columns, mode=state_mode)
+
+		# Gravity drops the current piece one row every `fall_ticks` steps, speeding up every `level_ticks` steps
+		self.start_fall_ticks = fall_ticks
+		self.min_fall_ticks = min_fall_ticks
+		self.level_ticks = level_ticks
+
+		# Called as reward_function(rows_cleared=..., terminal=...), defaults to the change in game score
+		self.reward_function = reward_function
+
+		self.current_piece = None
+		self.next_piece = None
+		self.fall_ticks = fall_ticks
+		self.fall_time = 0
+		self.level_time = 0
+		self.score = 0
+		self.lines = 0
+		self.pieces = 0
+		self.steps = 0
+		self.done = True
+
+	def reset(self, seed: Optional[int] = None) -> np.ndarray:
+		self.episode_seed = seed if seed is not None else self.seed_rng.getrandbits(63)
+		self.tetris.generator.seed(self.episode_seed)
+
+		self.board.reset()
+		self.encoder.reset()
+		self.current_piece = self.tetris.get_shape()
+		self.next_piece = self.tetris.get_shape()
+		self.fall_ticks = self.start_fall_ticks
+		self.fall_time = 0
+		self.level_time = 0
+		self.score = 0
+		self.lines = 0
+		self.pieces = 0
+		self.steps = 0
+		self.done = False
+		return self.observe()
+
+	def reward(self, rows_cleared: int = 0, terminal: bool = False) -> int:
+		if self.reward_function is not None:
+			return self.reward_function(rows_cleared=rows_cleared, terminal=terminal)
+		return rows_cleared * 10
+
+	def move(self, action: int):
+		piece = self.current_piece
+		if action == 0:
+			if self.board.valid_space(piece, x=piece.x - 1):
+				piece.x -= 1
+		elif action == 1:
+			if self.board.valid_space(piece, x=piece.x + 1):
+				piece.x += 1
+		elif action == 2:
+			if self.board.valid_space(piece, y=piece.y + 1):
+				piece.y += 1
+		elif action == 3:
+			if self.board.valid_space(piece, rotation=piece.rotation + 1):
+				piece.rotation += 1
+
+	def step(self, action: int) -> tuple[np.ndarray, int, bool, dict]:
+		assert(not self.done), "step() called on a finished episode, call reset() first"
+
+		self.move(action)
+
+		self.steps += 1
+		self.fall_time += 1
+		self.level_time += 1
+
+		# Increase difficulty every `level_ticks` steps until the minimum fall interval is reached
+		if self.level_time >= self.level_ticks:
+			self.level_time = 0
+			if self.fall_ticks > self.min_fall_ticks:
+				self.fall_ticks -= 1
+
+		change_piece = False
+		if self.fall_time >= self.fall_ticks:
+			self.fall_time = 0
+			if self.board.valid_space(self.current_piece, y=self.current_piece.y + 1):
+				self.current_piece.y += 1
+			elif self.current_piece.y + 1 > 0:
+				change_piece = True
+
+		rows_cleared = 0
+		if change_piece:
+			self.board.lock(self.current_piece)
+
+			self.current_piece = self.next_piece
+			self.next_piece = self.tetris.get_shape()
+			self.pieces += 1
+
+			rows_cleared = self.board.clear_rows()
+			if self.compute_observations:
+				self.encoder.set_locked(self.board.occupancy())
+			self.lines += rows_cleared
+			self.score += rows_cleared * 10
+
+		self.done = self.board.check_loss()
+		reward = self.reward(rows_cleared=rows_cleared, terminal=self.done)
+
+		info = {'score': self.score, 'lines': self.lines, 'pieces': self.pieces, 'steps': self.steps,
+				'rows_cleared': rows_cleared, 'locked': change_piece}
+		return self.observe(), reward, self.done, info
+
+	def placements(self) -> tuple[list[tuple], np.ndarray]:
+		# Every legal (rotation, x, y) straight drop of the current piece from its spawn height, with the resulting afterstates
+		piece = self.current_piece
+		placements = self.board.placements(piece)
+		if not self.compute_observations:
+			return placements, None
+		return placements, self.encoder.encode_row_masks([self.board.afterstate(piece, placement)[0].board for placement in placements])
+
+	def place(self, placement: tuple) -> tuple[np.ndarray, int, bool, dict]:
+		# Lock the current piece at a placement from placements() in a single step, one decision per piece
+		assert(not self.done), "place() called on a finished episode, call reset() first"
+		rotation, x, y = placement
+		self.current_piece.rotation, self.current_piece.x, self.current_piece.y = rotation, x, y
+		self.board.lock(self.current_piece)
+
+		self.current_piece = self.next_piece
+		self.next_piece = self.tetris.get_shape()
+		self.pieces += 1
+		self.steps += 1
+
+		rows_cleared = self.board.clear_rows()
+		if self.compute_observations:
+			self.encoder.set_locked(self.board.occupancy())
+		self.lines += rows_cleared
+		self.score += rows_cleared * 10
+
+		# A new piece with nowhere to go also ends the game
+		self.done = self.board.check_loss() or not self.board.valid_space(self.current_piece)
+		reward = self.reward(rows_cleared=rows_cleared, terminal=self.done)
+
+		info = {'score': self.score, 'lines': self.lines, 'pieces': self.pieces, 'steps': self.steps,
+				'rows_cleared': rows_cleared, 'locked': True}
+		return self.observe(), reward, self.done, info
+
+	def observe(self) -> Optional[np.ndarray]:
+		if not self.compute_observations:
+			return None
+		if self.metrics is not None:
+			with self.metrics.phase('encode'):
+				return self.encode()
+		return self.encode()
+
+	def encode(self) -> np.ndarray:
+		# Binary occupancy of locked cells and the falling piece (same layout as TetrisAgent.process_state_space), or features
+		piece_position = self.tetris.convert_shape_format(self.current_piece) if self.current_piece is not None else []
+		return self.encoder.encode(piece_position)
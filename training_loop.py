@@ -0,0 +1,130 @@
+""" Headless training episodes shared by rl_tetris and sweep.py, so a sweep trial runs exactly the loop the winning config trains with """
+from typing import Optional
+
+import numpy as np
+
+from episode_log import EpisodeLog
+from metrics import TrainingMetrics
+from planner import BeamSearchPlanner
+from tetris_env import TetrisEnv
+
+
+# Keyword arguments of TetrisAgent
+AGENT_KEYS = ('action_mode', 'state_mode', 'target_update', 'polyak_tau', 'double_dqn', 'alpha', 'epsilon', 'gamma',
+			  'passive_reward', 'line_reward', 'tetris_reward', 'game_over_reward', 'memory')
+
+# Options of the training loop: learning cadence, placement lookahead, an optional step cap per episode and the base seed
+# episode i is dealt seed + i from (None deals unseeded games)
+TRAINING_DEFAULTS = {'train_every': 0, 'mini_batch_size': 32, 'learning_starts': 1000, 'plan_depth': 0, 'beam_width': 8,
+					 'plan_time_budget': 0.05, 'max_steps': None, 'seed': None}
+
+
+def split_config(config: dict) -> tuple[dict, dict]:
+	# A flat config (a sweep trial, rl_tetris.AGENT_CONFIG) split into TetrisAgent keyword arguments and loop options
+	unknown = set(config) - set(AGENT_KEYS) - set(TRAINING_DEFAULTS)
+	if unknown:
+		raise ValueError('Unknown config keys: {}'.format(', '.join(sorted(unknown))))
+	return ({key: value for key, value in config.items() if key in AGENT_KEYS},
+			{key: value for key, value in config.items() if key in TRAINING_DEFAULTS})
+
+
+def episode_seed(options: dict, episode: int) -> Optional[int]:
+	# Derived from the episode index, so a resumed run continues the sequence and every sweep trial plays the same games
+	return None if options['seed'] is None else options['seed'] + episode
+
+
+def learn(player, metrics: TrainingMetrics, options: dict, steps: int = 1):
+	# One train_step for every multiple of train_every crossed by the last `steps` steps, so vector episodes keep the same cadence per transition
+	train_every = options['train_every']
+	if train_every <= 0 or player.replay_stats()['replay_size'] < options['learning_starts']:
+		return
+	with metrics.phase('train_step'):
+		for _ in range(metrics.steps // train_every - (metrics.steps - steps) // train_every):
+			player.train_step(mini_batch_size=options['mini_batch_size'])
+
+
+def finish_episode(player, metrics: TrainingMetrics, options: dict) -> dict:
+	# Without per-step learning the agent fits once per episode on a large minibatch
+	if options['train_every'] <= 0:
+		timings = player.train(mini_batch_size=1000, epochs=1)
+		metrics.add_time('train_step', sum(timings.values()))
+	return metrics.end_episode(**player.replay_stats())
+
+
+def capped(env: TetrisEnv, options: dict) -> bool:
+	return options['max_steps'] is not None and env.steps >= options['max_steps']
+
+
+def run_move_episode(player, env: TetrisEnv, metrics: TrainingMetrics, options: dict, seed: Optional[int] = None, record: bool = False) -> dict:
+	state_space = env.reset(seed=seed)
+	log = EpisodeLog(env.episode_seed, env.generator, 'move') if record else None
+
+	done = False
+	while not done and not capped(env, options):
+		with metrics.phase('inference'):
+			action = player.epsilon_greedy_selection(state_space=state_space.reshape(1, -1))
+		if log is not None:
+			log.record(action)
+		with metrics.phase('env_step'):
+			state_space_prime, reward, done, _ = env.step(action)
+		with metrics.phase('replay_insert'):
+			player.update_replay_buffer(state_space=state_space, action=action, reward=reward, state_space_prime=state_space_prime, terminal_state=done)
+		state_space = state_space_prime
+		metrics.step(transitions=1)
+		learn(player, metrics, options)
+
+	return {'score': env.score, 'lines': env.lines, 'pieces': env.pieces, 'steps': env.steps, 'capped': not done, 'log': log}
+
+
+def run_placement_episode(player, env: TetrisEnv, metrics: TrainingMetrics, options: dict, seed: Optional[int] = None, record: bool = False) -> dict:
+	env.reset(seed=seed)
+	log = EpisodeLog(env.episode_seed, env.generator, 'placement') if record else None
+
+	planner = None
+	epsilon = player.hyperparameters()['epsilon']
+	if options['plan_depth'] > 0:
+		# Lookahead discounts like the learner's Bellman targets, so planned and learned values stay on the same scale
+		planner = BeamSearchPlanner(player.state_action_q_values, player.reward_function, encoder=env.encoder, beam_width=options['beam_width'],
+									depth=options['plan_depth'], gamma=player.hyperparameters()['gamma'], time_budget=options['plan_time_budget'])
+	train_steps = player.train_steps()
+
+	# Each transition links the chosen afterstate to the afterstate chosen for the following piece
+	pending = None
+	done = False
+	while not done and not capped(env, options):
+		with metrics.phase('encode'):
+			placements, afterstates = env.placements()
+		if not placements:
+			# Running out of placements also ends the game
+			done = True
+			break
+		with metrics.phase('inference'):
+			if planner is None:
+				index = player.select_placement(afterstates=afterstates)
+			elif np.random.uniform(0, 1) < epsilon:
+				# The planner itself is greedy, training explores at the agent's rate as select_placement does
+				index = np.random.randint(len(afterstates))
+			else:
+				# Cached afterstate values go stale as soon as the network trains
+				if player.train_steps() != train_steps:
+					planner.clear_cache()
+					train_steps = player.train_steps()
+				index = planner.plan(env.board, [env.current_piece, env.next_piece])
+		if log is not None:
+			log.record(index)
+		if pending is not None:
+			with metrics.phase('replay_insert'):
+				player.update_replay_buffer(state_space=pending[0], action=0, reward=pending[1], state_space_prime=afterstates[index], terminal_state=False)
+
+		with metrics.phase('env_step'):
+			_, reward, done, _ = env.place(placements[index])
+		pending = (afterstates[index], reward)
+		metrics.step(transitions=1)
+		learn(player, metrics, options)
+
+	# A finished game's last transition carries the game over reward, a capped game's has no successor yet and is not stored
+	if pending is not None and done:
+		reward = pending[1] if env.done else player.reward_function(terminal=True)
+		player.update_replay_buffer(state_space=pending[0], action=0, reward=reward, state_space_prime=pending[0], terminal_state=True)
+	return {'score': env.score, 'lines': env.lines, 'pieces': env.pieces, 'steps': env.steps, 'capped': not done, 'log': log,
+			'planner': planner.stats if planner is not None else None}
@@ -0,0 +1,177 @@
+""" Vectorized environment stepping N headless Tetris boards in lockstep on NumPy arrays """
+from typing import Callable, Optional
+
+import numpy as np
+
+from piece import SHAPE_START_POS, cell_offsets
+
+
+SHAPES = ['S', 'Z', 'I', 'O', 'J', 'L', 'T']
+
+
+def compile_cell_offsets() -> np.ndarray:
+	# (shape, rotation, cell, [dx, dy]) offsets relative to (piece.x, piece.y), rotations padded to 4 by wrapping
+	offsets = np.zeros(shape=(len(SHAPES), 4, 4, 2), dtype=np.int64)
+	for s, name in enumerate(SHAPES):
+		for r in range(4):
+			offsets[s, r] = cell_offsets(name, r)
+	return offsets
+
+
+CELL_OFFSETS = compile_cell_offsets()
+SPAWN_POSITIONS = np.array([SHAPE_START_POS[name] for name in SHAPES], dtype=np.int64)
+
+# Per-action (dx, dy, drotation) for move left, move right, soft drop, rotate
+ACTION_DELTAS = np.array([(-1, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)], dtype=np.int64)
+
+
+class VectorTetris:
+	def __init__(self, num_envs: int, fall_ticks: int = 3, min_fall_ticks: int = 1, level_ticks: int = 500,
+				 reward_function: Optional[Callable[..., np.ndarray]] = None, seed: Optional[int] = None):
+		self.num_envs = num_envs
+		self.rows = 20
+		self.columns = 10
+
+		self.start_fall_ticks = fall_ticks
+		self.min_fall_ticks = min_fall_ticks
+		self.level_ticks = level_ticks
+
+		# Called as reward_function(rows_cleared=..., terminal=...) on arrays, defaults to the change in game score
+		self.reward_function = reward_function
+		self.rng = np.random.default_rng(seed)
+
+		self.boards = np.zeros(shape=(num_envs, self.rows, self.columns), dtype=np.uint8)
+		self.shape = np.zeros(num_envs, dtype=np.int64)
+		self.next_shape = np.zeros(num_envs, dtype=np.int64)
+		self.rotation = np.zeros(num_envs, dtype=np.int64)
+		self.x = np.zeros(num_envs, dtype=np.int64)
+		self.y = np.zeros(num_envs, dtype=np.int64)
+		self.fall_ticks = np.full(num_envs, fall_ticks, dtype=np.int64)
+		self.fall_time = np.zeros(num_envs, dtype=np.int64)
+		self.level_time = np.zeros(num_envs, dtype=np.int64)
+		self.score = np.zeros(num_envs, dtype=np.int64)
+		self.lines = np.zeros(num_envs, dtype=np.int64)
+		self.pieces = np.zeros(num_envs, dtype=np.int64)
+		self.steps = np.zeros(num_envs, dtype=np.int64)
+
+	def reset(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+		# Reset the boards selected by a boolean mask, or all of them
+		mask = np.ones(self.num_envs, dtype=bool) if mask is None else mask
+		count = int(mask.sum())
+
+		self.boards[mask] = 0
+		self.next_shape[mask] = self.rng.integers(len(SHAPES), size=count)
+		self.spawn(mask)
+		self.fall_ticks[mask] = self.start_fall_ticks
+		self.fall_time[mask] = 0
+		self.level_time[mask] = 0
+		self.score[mask] = 0
+		self.lines[mask] = 0
+		self.pieces[mask] = 0
+		self.steps[mask] = 0
+		return self.observe()
+
+	def spawn(self, mask: np.ndarray):
+		# Promote the next piece to current and draw a new next piece for the selected boards
+		self.shape[mask] = self.next_shape[mask]
+		self.next_shape[mask] = self.rng.integers(len(SHAPES), size=int(mask.sum()))
+		self.rotation[mask] = 0
+		self.x[mask] = SPAWN_POSITIONS[self.shape[mask], 0]
+		self.y[mask] = SPAWN_POSITIONS[self.shape[mask], 1]
+
+	def cells(self, x: np.ndarray, y: np.ndarray, rotation: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		offsets = CELL_OFFSETS[self.shape, rotation % 4]
+		return x[:, None] + offsets[:, :, 0], y[:, None] + offsets[:, :, 1]
+
+	def valid_space(self, x: np.ndarray, y: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+		# Same semantics as Tetris.valid_space, evaluated for every board at once
+		cell_x, cell_y = self.cells(x, y, rotation)
+		on_board = cell_y >= 0
+		out_of_bounds = (cell_y >= self.rows) | (on_board & ((cell_x < 0) | (cell_x >= self.columns)))
+
+		env_index = np.broadcast_to(np.arange(self.num_envs)[:, None], cell_x.shape)
+		occupied = self.boards[env_index, np.clip(cell_y, 0, self.rows - 1), np.clip(cell_x, 0, self.columns - 1)] == 1
+		return ~(out_of_bounds | (on_board & occupied)).any(axis=1)
+
+	def step(self, actions: np.ndarray, auto_reset: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+		actions = np.asarray(actions, dtype=np.int64)
+		deltas = ACTION_DELTAS[actions]
+
+		# Apply each board's move only where the moved piece still fits
+		new_x, new_y, new_rotation = self.x + deltas[:, 0], self.y + deltas[:, 1], self.rotation + deltas[:, 2]
+		moved = self.valid_space(new_x, new_y, new_rotation)
+		self.x = np.where(moved, new_x, self.x)
+		self.y = np.where(moved, new_y, self.y)
+		self.rotation = np.where(moved, new_rotation, self.rotation)
+
+		self.steps += 1
+		self.fall_time += 1
+		self.level_time += 1
+
+		level_up = self.level_time >= self.level_ticks
+		self.level_time[level_up] = 0
+		self.fall_ticks[level_up & (self.fall_ticks > self.min_fall_ticks)] -= 1
+
+		# Gravity, boards whose piece cannot fall any further lock it in place
+		falling = self.fall_time >= self.fall_ticks
+		self.fall_time[falling] = 0
+		can_fall = self.valid_space(self.x, self.y + 1, self.rotation)
+		self.y = np.where(falling & can_fall, self.y + 1, self.y)
+		lock = falling & ~can_fall & (self.y + 1 > 0)
+
+		topped_out = np.zeros(self.num_envs, dtype=bool)
+		rows_cleared = np.zeros(self.num_envs, dtype=np.int64)
+		if lock.any():
+			topped_out = self.lock(lock)
+			rows_cleared = self.clear_rows()
+			self.spawn(lock)
+			self.pieces += lock
+			self.lines += rows_cleared
+			self.score += rows_cleared * 10
+
+		done = topped_out | self.boards[:, 0].any(axis=1)
+		rewards = self.reward(rows_cleared=rows_cleared, terminal=done)
+
+		info = {'score': self.score.copy(), 'lines': self.lines.copy(), 'pieces': self.pieces.copy(),
+				'steps': self.steps.copy(), 'rows_cleared': rows_cleared, 'locked': lock}
+		if auto_reset and done.any():
+			self.reset(done)
+		return self.observe(), rewards, done, info
+
+	def lock(self, mask: np.ndarray) -> np.ndarray:
+		env_index = np.nonzero(mask)[0]
+		cell_x, cell_y = self.cells(self.x, self.y, self.rotation)
+		cell_x, cell_y = cell_x[env_index], cell_y[env_index]
+
+		on_board = cell_y >= 0
+		rows = np.broadcast_to(env_index[:, None], cell_x.shape)
+		self.boards[rows[on_board], cell_y[on_board], cell_x[on_board]] = 1
+
+		# A locked cell above the board always ends the game
+		topped_out = np.zeros(self.num_envs, dtype=bool)
+		topped_out[env_index] = ~on_board.all(axis=1)
+		return topped_out
+
+	def clear_rows(self) -> np.ndarray:
+		full = self.boards.all(axis=2)
+		rows_cleared = full.sum(axis=1)
+		if rows_cleared.any():
+			# Stable sort moves full rows to the top while keeping the remaining rows in order, then blank them
+			order = np.argsort(~full, axis=1, kind='stable')
+			self.boards = np.take_along_axis(self.boards, order[:, :, None], axis=1)
+			self.boards[np.arange(self.rows)[None, :] < rows_cleared[:, None]] = 0
+		return rows_cleared
+
+	def reward(self, rows_cleared: np.ndarray, terminal: np.ndarray) -> np.ndarray:
+		if self.reward_function is not None:
+			return self.reward_function(rows_cleared=rows_cleared, terminal=terminal)
+		return rows_cleared * 10
+
+	def observe(self) -> np.ndarray:
+		# Batched (N, 200) occupancy of locked cells and the falling piece, matching TetrisEnv.observe
+		state_spaces = self.boards.astype(np.float32)
+		cell_x, cell_y = self.cells(self.x, self.y, self.rotation)
+		visible = (cell_y >= 0) & (cell_y < self.rows) & (cell_x >= 0) & (cell_x < self.columns)
+		env_index = np.broadcast_to(np.arange(self.num_envs)[:, None], cell_x.shape)
+		state_spaces[env_index[visible], cell_y[visible], cell_x[visible]] = 1
+		return state_spaces.reshape(self.num_envs, -1)